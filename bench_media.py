@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+"""Headless benchmarks for the show_media scan, decode and database paths.
+
+Generates a synthetic corpus (images of a given size and a CSV database like
+test/photos.csv), times FileList construction, the load/scale pipeline used by
+App.__setImage, PhotoDB load/save and keyword operations, and prints one JSON
+object per measurement so runs can be compared across releases.
+
+    bench_media.py --images 50 --megapixels 12,40 --rows 10000,100000
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+from PIL import Image
+
+import show_media
+
+KEYWORDS = [
+    "#beach",
+    "#sunset",
+    "#family",
+    "#dog",
+    "#mountain",
+    "#city",
+    "@alice",
+    "@bob",
+    "!best",
+]
+
+
+def emit(out, benchmark, params, samples) -> None:
+    samples = sorted(samples)
+    record = {
+        "benchmark": benchmark,
+        "params": params,
+        "n": len(samples),
+        "total_s": round(sum(samples), 6),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p50_ms": round(show_media.Profiler.percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(show_media.Profiler.percentile(samples, 95) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+    out.write(json.dumps(record) + "\n")
+    out.flush()
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def heic_encoder():
+    try:
+        import pillow_heif
+    except ImportError:
+        return None
+    pillow_heif.register_heif_opener()
+    return "HEIF"
+
+
+def make_image(megapixels):
+    w = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    h = int(w * 3 / 4)
+    # Noise upscaled over gradients gives JPEG sizes close to real photos.
+    noise = Image.effect_noise((w // 8, h // 8), 64).resize((w, h), Image.BILINEAR)
+    gradient = Image.linear_gradient("L").resize((w, h))
+    return Image.merge(
+        "RGB", (noise, gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT))
+    )
+
+
+def make_corpus(directory, count, megapixels, formats) -> list:
+    image = make_image(megapixels)
+    paths = []
+    for i in range(count):
+        for extension, save_format in formats:
+            subdirectory = directory / ("%03d" % (i % 10))
+            subdirectory.mkdir(parents=True, exist_ok=True)
+            path = subdirectory / ("img_%05d%s" % (i, extension))
+            image.save(path, save_format, quality=90)
+            paths.append(path)
+    return paths
+
+
+def make_database(filename, rows) -> None:
+    rng = random.Random(rows)
+    pd.DataFrame(
+        {
+            "filename": ["img_%07d.jpg" % i for i in range(rows)],
+            "hash": ["%064x" % rng.getrandbits(256) for _ in range(rows)],
+            "size": [rng.randrange(1 << 20, 1 << 25) for _ in range(rows)],
+            "directory": ["/photos/%03d" % (i % 1000) for i in range(rows)],
+            "rating": [rng.randrange(-1, 11) for _ in range(rows)],
+            "keywords": [
+                " ".join(rng.sample(KEYWORDS, rng.randrange(0, 4))) for _ in range(rows)
+            ],
+        }
+    ).to_csv(filename, index=False)
+
+
+def bench_filelist(out, directory, files) -> None:
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        first, f = timed(show_media.FileList, recursive=True)
+        complete, _ = timed(f.wait)
+    finally:
+        os.chdir(cwd)
+    params = {"files": files}
+    emit(out, "filelist_first", params, [first])
+    emit(out, "filelist_complete", params, [first + complete])
+
+
+def bench_decode(out, paths, megapixels, w, h) -> None:
+    by_type = {}
+    for path in paths:
+        for benchmark, fast in (("load_image", False), ("load_image_preview", True)):
+            seconds, _ = timed(show_media.load_image, str(path), w, h, fast)
+            by_type.setdefault((benchmark, path.suffix.lower()), []).append(seconds)
+    for (benchmark, extension), samples in sorted(by_type.items()):
+        params = {
+            "type": extension,
+            "megapixels": megapixels,
+            "target": "%dx%d" % (w, h),
+        }
+        emit(out, benchmark, params, samples)
+
+
+def bench_database(out, directory, rows) -> None:
+    filename = str(directory / ("photos_%d.csv" % rows))
+    make_database(filename, rows)
+    params = {"rows": rows}
+
+    seconds, db = timed(show_media.PhotoDB, filename)
+    emit(out, "photodb_load", params, [seconds])
+    names = list(db.photo_df.index[:: max(1, rows // 1000)])
+    emit(out, "photodb_row", params, [timed(db.row, name)[0] for name in names])
+    emit(
+        out,
+        "photodb_set_rating",
+        params,
+        [timed(db.set_rating, name, 5)[0] for name in names],
+    )
+    emit(out, "photodb_save", params, [timed(db.save)[0]])
+
+    seconds, counts = timed(db.keyword_counts)
+    emit(out, "keyword_counts", params, [seconds])
+    seconds, dictionary = timed(show_media.KeywordDictionary, counts)
+    emit(out, "keyword_dictionary_build", params, [seconds])
+    emit(
+        out,
+        "keyword_prefix",
+        params,
+        [timed(dictionary.matches, p, 8)[0] for p in ("#", "#b", "@", "!")],
+    )
+    terms = show_media.parse_filter("rating>=8 #beach -#sunset")
+    seconds, _ = timed(db.query, terms)
+    emit(out, "filter_first_query", params, [seconds])
+    emit(out, "filter_query", params, [timed(db.query, terms)[0] for _ in range(10)])
+
+    journal = show_media.PhotoDB(filename, journal=True)
+    emit(
+        out,
+        "journal_set_keywords",
+        params,
+        [timed(journal.set_keywords, name, "#beach")[0] for name in names],
+    )
+    seconds, _ = timed(journal.compact)
+    emit(out, "journal_compact", params, [seconds])
+
+    sqlite_filename = str(directory / ("photos_%d.sqlite" % rows))
+    sqlite_db = show_media.SQLitePhotoDB(sqlite_filename)
+    seconds, _ = timed(sqlite_db.import_frame, pd.read_csv(filename))
+    emit(out, "sqlite_import", params, [seconds])
+    seconds, sqlite_db = timed(show_media.SQLitePhotoDB, sqlite_filename)
+    emit(out, "sqlite_load", params, [seconds])
+    emit(out, "sqlite_row", params, [timed(sqlite_db.row, name)[0] for name in names])
+    emit(
+        out,
+        "sqlite_set_rating",
+        params,
+        [timed(sqlite_db.set_rating, name, 5)[0] for name in names],
+    )
+    emit(
+        out,
+        "sqlite_filter_query",
+        params,
+        [timed(sqlite_db.query, terms)[0] for _ in range(10)],
+    )
+
+
+def parse_list(value, kind):
+    return [kind(v) for v in value.split(",")]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark show_media without a display"
+    )
+    parser.add_argument(
+        "--images", help="images per format and size", type=int, default=20
+    )
+    parser.add_argument(
+        "--megapixels", help="comma separated image sizes", default="12"
+    )
+    parser.add_argument(
+        "--formats", help="comma separated from jpg,png,heic", default="jpg,png,heic"
+    )
+    parser.add_argument(
+        "--rows", help="comma separated database sizes", default="1000,100000"
+    )
+    parser.add_argument("--size", help="display size WxH", default="1920x1080")
+    parser.add_argument(
+        "--workdir", help="keep the corpus in this directory", default=None
+    )
+    parser.add_argument(
+        "--output", help="write JSON lines here instead of stdout", default=None
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    w, h = (int(v) for v in args.size.split("x"))
+    formats = []
+    for name in args.formats.split(","):
+        if name == "heic":
+            encoder = heic_encoder()
+            if encoder is None:
+                print(
+                    "Skipping heic: no HEIF encoder (pip install pillow_heif)",
+                    file=sys.stderr,
+                )
+                continue
+            formats.append((".heic", encoder))
+        else:
+            formats.append(("." + name, {"jpg": "JPEG", "png": "PNG"}[name]))
+
+    directory = Path(args.workdir or tempfile.mkdtemp(prefix="bench_media_"))
+    directory.mkdir(parents=True, exist_ok=True)
+    out = open(args.output, "w") if args.output else sys.stdout
+    out.write(
+        json.dumps(
+            {
+                "benchmark": "environment",
+                "python": platform.python_version(),
+                "pillow": Image.__version__,
+                "pandas": pd.__version__,
+                "cpus": os.cpu_count(),
+            }
+        )
+        + "\n"
+    )
+    # Keep show_media's progress messages out of the JSON stream.
+    with contextlib.redirect_stdout(sys.stderr):
+        run(out, args, directory, formats, w, h)
+
+
+def run(out, args, directory, formats, w, h) -> None:
+    try:
+        paths = []
+        for megapixels in parse_list(args.megapixels, float):
+            corpus = make_corpus(
+                directory / ("%gmp" % megapixels), args.images, megapixels, formats
+            )
+            bench_decode(out, corpus, megapixels, w, h)
+            paths += corpus
+        bench_filelist(out, directory, len(paths))
+        for rows in parse_list(args.rows, int):
+            bench_database(out, directory, rows)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
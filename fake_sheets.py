@@ -0,0 +1,142 @@
+"""In-memory stand-in for the parts of pygsheets used by show_media.PhotoDB.
+
+Lets the Google Sheets backend run without network access:
+
+    client = FakeClient({"photodb": pd.read_csv("test/photos.csv")})
+    db = PhotoDB("photodb", client=client)
+
+Every worksheet records the API calls made against it in `calls`, and every
+change bumps the spreadsheet's `updated` time, like edits in the browser do.
+"""
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+
+def _cell(a1):
+    letters = "".join(c for c in a1 if c.isalpha())
+    row = int(a1[len(letters):])
+    col = 0
+    for c in letters.upper():
+        col = col * 26 + ord(c) - ord("A") + 1
+    return row - 1, col - 1
+
+
+class FakeWorksheet:
+    def __init__(self, title, values=None, spreadsheet=None):
+        self.title = title
+        self.values = values or []
+        self.calls = []
+        self.spreadsheet = spreadsheet
+
+    def __touch(self) -> None:
+        if self.spreadsheet is not None:
+            self.spreadsheet.revision += 1
+
+    def __fit(self, rows, cols) -> None:
+        while len(self.values) < rows:
+            self.values.append([])
+        for row in self.values:
+            row.extend([""] * (cols - len(row)))
+
+    def get_as_df(self):
+        self.calls.append(("get_as_df",))
+        if not self.values:
+            return pd.DataFrame()
+        return pd.DataFrame(self.values[1:], columns=self.values[0])
+
+    def get_all_values(self):
+        self.calls.append(("get_all_values",))
+        return [list(row) for row in self.values]
+
+    def clear(self) -> None:
+        self.calls.append(("clear",))
+        self.values = []
+        self.__touch()
+
+    def set_dataframe(self, df, start, copy_index=False, extend=False) -> None:
+        self.calls.append(("set_dataframe", len(df)))
+        if copy_index:
+            df = df.reset_index()
+        row0, col0 = _cell(start)
+        rows = [list(df.columns)] + df.values.tolist()
+        self.__fit(row0 + len(rows), col0 + len(rows[0]))
+        for r, row in enumerate(rows):
+            self.values[row0 + r][col0 : col0 + len(row)] = row
+        self.__touch()
+
+    def update_value(self, addr, val) -> None:
+        self.calls.append(("update_value", addr))
+        row0, col0 = _cell(addr)
+        self.__fit(row0 + 1, col0 + 1)
+        self.values[row0][col0] = val
+        self.__touch()
+
+    def update_values_batch(self, ranges, values, majordim="ROWS") -> None:
+        self.calls.append(("update_values_batch", list(ranges)))
+        for a1, block in zip(ranges, values):
+            row0, col0 = _cell(a1.split(":")[0])
+            for r, row in enumerate(block):
+                self.__fit(row0 + r + 1, col0 + len(row))
+                self.values[row0 + r][col0 : col0 + len(row)] = row
+        self.__touch()
+
+    def append_table(self, values, start="A1", end=None, dimension="ROWS", overwrite=False):
+        self.calls.append(("append_table", len(values)))
+        width = max([len(self.values[0]) if self.values else 0] + [len(v) for v in values])
+        self.__fit(len(self.values), width)
+        for row in values:
+            self.values.append(list(row) + [""] * (width - len(row)))
+        self.__touch()
+
+
+class FakeSpreadsheet:
+    def __init__(self, title, worksheets):
+        self.title = title
+        self.id = title
+        self.worksheets = worksheets
+        self.revision = 0
+        for worksheet in worksheets:
+            worksheet.spreadsheet = self
+
+    @property
+    def updated(self) -> str:
+        """Modification time in RFC 3339 format; one second per change."""
+        updated = datetime(2000, 1, 1) + timedelta(seconds=self.revision)
+        return updated.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    @property
+    def sheet1(self):
+        return self.worksheets[0]
+
+    def add_worksheet(self, title, rows=100, cols=26, index=0):
+        worksheet = FakeWorksheet(title, spreadsheet=self)
+        self.worksheets.insert(index, worksheet)
+        self.revision += 1
+        return worksheet
+
+    def worksheet(self, property="index", value=0):
+        if property == "index":
+            return self.worksheets[value]
+        return next(w for w in self.worksheets if getattr(w, property) == value)
+
+    def del_worksheet(self, worksheet) -> None:
+        self.worksheets.remove(worksheet)
+        self.revision += 1
+
+
+class FakeClient:
+    """Client whose spreadsheets are built from {title: DataFrame}."""
+
+    def __init__(self, spreadsheets):
+        self.spreadsheets = {}
+        for title, df in spreadsheets.items():
+            values = [list(df.columns)] + df.values.tolist()
+            # Like the real client, the extra sheets give save() backups to rotate.
+            worksheets = [FakeWorksheet("Sheet1", values)] + [
+                FakeWorksheet("backup%d" % i) for i in range(3)
+            ]
+            self.spreadsheets[title] = FakeSpreadsheet(title, worksheets)
+
+    def open(self, title):
+        return self.spreadsheets[title]
@@ -1,32 +1,96 @@
 #!/usr/bin/python3
 import argparse
+import atexit
+import bisect
+import ctypes
+import ctypes.util
+import hashlib
+import heapq
+import io
+import json
+import operator
+import os
+import queue
 import re
+import sqlite3
+import struct
 import sys
+import threading
+import time
 import tkinter
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing, contextmanager
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
 from typing import Union
 
-import gi
-
-import pandas as pd
-import pygsheets
-
 from PIL import Image, ImageOps, ImageTk
-import pyheif
-import time
-gi.require_version("Gst", "1.0")
-from gi.repository import GObject, Gst
 
-# Needed for set_window_handle():
-gi.require_version("GstVideo", "1.0")
-from gi.repository import GstVideo
+# pandas, pygsheets, pyheif and GStreamer are imported where they are first
+# needed, so showing the first image does not wait for them.
+STARTED = time.perf_counter()
 
 SECRET_FILE = "credentials.json"
 SECRET_DIRECTORY = str(Path.home()) + "/.google"
+CACHE_DIRECTORY = str(Path.home()) + "/.cache/media_tools"
+DB_COLUMNS = ["hash", "size", "directory", "rating", "keywords"]
+HASH_CHUNK_SIZE = 1024 * 1024
+STAT_CHUNK_SIZE = 1024
+JOURNAL_COMPACT_RECORDS = 10000
+KEYWORD_SUGGESTIONS = 8
+VIDEO_PREROLL_SEARCH = 50
+POSTER_TIMEOUT = 5 * 1000 * 1000 * 1000  # nanoseconds, like Gst.SECOND
+WATCH_POLL_SECONDS = 2.0
+WATCH_UI_INTERVAL = 250  # milliseconds
+SAVE_POLL_INTERVAL = 100  # milliseconds
+SAVE_STATUS_SECONDS = 3
+TILE_SIZE = 256
+ZOOM_OVERVIEW_PIXELS = 16 * 1000 * 1000
+ZOOM_DECODE_PIXELS = 48 * 1000 * 1000
+RAW_STRIP_BYTES = 32 * 1024 * 1024
+ZOOM_STEP = 1.5
+ZOOM_MAX_SCALE = 4.0
+ZOOM_PREFETCH = 2
+
+# inotify(7) event bits.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+)
 
 Image.MAX_IMAGE_PIXELS = None
+EXIF_ORIENTATION = 0x0112
+EXIF_MODEL = 0x0110
+EXIF_DATE_TIME = 0x0132
+EXIF_IFD = 0x8769
+EXIF_DATE_TIME_ORIGINAL = 0x9003
+MP4_EPOCH_OFFSET = 2082844800  # seconds from 1904-01-01, the MP4 epoch, to 1970
+METADATA_WORKERS = 32
+METADATA_MEMORY_ENTRIES = 100 * 1000
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+Metadata = namedtuple(
+    "Metadata",
+    ["taken", "orientation", "width", "height", "model"],
+    defaults=(None, 1, None, None, None),
+)
 
 # Merge ratingValue and star into a dict. Otherwise they are two dangling items.
 ratingvalue = {
@@ -59,6 +123,147 @@ star = {
 }
 
 
+_gst = None
+_gst_lock = threading.Lock()
+
+
+def gst():
+    """Import and initialize GStreamer on first use and return the Gst module."""
+    global _gst
+    with _gst_lock:
+        if _gst is not None:
+            return _gst
+        import gi
+
+        gi.require_version("Gst", "1.0")
+        # Needed for set_window_handle():
+        gi.require_version("GstVideo", "1.0")
+        from gi.repository import Gst, GstVideo  # noqa: F401
+
+        Gst.init(None)
+        _gst = Gst
+        return _gst
+
+
+def process_started() -> float:
+    """The perf_counter() value at process launch, or at import without /proc."""
+    try:
+        with open("/proc/self/stat") as fp:
+            ticks = int(fp.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as fp:
+            uptime = float(fp.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return STARTED
+    return time.perf_counter() - uptime + ticks / os.sysconf("SC_CLK_TCK")
+
+
+class StartupTimer:
+    """Marks the phases from process launch to the first painted frame."""
+
+    def __init__(self):
+        self.marks = [("launch", process_started()), ("imports", STARTED)]
+
+    def mark(self, phase) -> None:
+        self.marks.append((phase, time.perf_counter()))
+
+    def report(self) -> None:
+        launch = self.marks[0][1]
+        for (_previous, start), (phase, end) in zip(self.marks, self.marks[1:]):
+            print("%-12s %8.1f ms" % (phase, (end - start) * 1000))
+        print("%-12s %8.1f ms" % ("total", (self.marks[-1][1] - launch) * 1000))
+
+
+class Profiler:
+    """Timing spans for the stages of showing a file.
+
+    Samples are kept per (stage, file type) and summarized as p50/p95/max by
+    report(). Spans recorded on the Tk thread between begin_event() and
+    end_event() are also written as one JSON line per navigation event when a
+    trace file is given. Disabled, span() only costs a flag check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+        self.trace = None
+        self.event = None
+
+    def enable(self, trace_filename=None) -> None:
+        self.enabled = True
+        if trace_filename:
+            self.trace = open(trace_filename, "w", encoding="utf-8")
+        atexit.register(self.report)
+
+    @contextmanager
+    def span(self, stage, kind=""):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.samples[(stage, kind)].append(elapsed)
+                event = self.event
+                if event is not None and event["thread"] == threading.get_ident():
+                    event["spans"].append((stage, round(elapsed * 1000, 3)))
+
+    def begin_event(self, name, filename) -> None:
+        if self.enabled:
+            self.event = {
+                "thread": threading.get_ident(),
+                "event": name,
+                "file": str(filename),
+                "type": Path(filename).suffix.lower(),
+                "start": time.perf_counter(),
+                "spans": [],
+            }
+
+    def end_event(self) -> None:
+        event, self.event = self.event, None
+        if event is None:
+            return
+        total = time.perf_counter() - event.pop("start")
+        event.pop("thread")
+        with self.lock:
+            self.samples[("navigation", event["type"])].append(total)
+        if self.trace is not None:
+            event["total_ms"] = round(total * 1000, 3)
+            self.trace.write(json.dumps(event) + "\n")
+            self.trace.flush()
+
+    @staticmethod
+    def percentile(samples, p) -> float:
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+    def report(self) -> None:
+        if not self.samples:
+            return
+        print(
+            "%-16s %-6s %7s %9s %9s %9s"
+            % ("stage", "type", "count", "p50 ms", "p95 ms", "max ms")
+        )
+        for (stage, kind), samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            print(
+                "%-16s %-6s %7d %9.1f %9.1f %9.1f"
+                % (
+                    stage,
+                    kind,
+                    len(samples),
+                    self.percentile(samples, 50) * 1000,
+                    self.percentile(samples, 95) * 1000,
+                    samples[-1] * 1000,
+                )
+            )
+
+
+PROFILER = Profiler()
+
+
 class FileType(Enum):
     UNKNOWN = 1
     IMAGE = 2
@@ -66,448 +271,4052 @@ class FileType(Enum):
 
     @staticmethod
     def getType(extension: str):
-        if extension.lower() in [".jpg", ".png", ".bmp", ".heic"]:
+        if extension.lower() in [
+            ".jpg",
+            ".png",
+            ".bmp",
+            ".heic",
+            ".tif",
+            ".tiff",
+            ".ppm",
+        ]:
             return FileType.IMAGE
         if extension.lower() in [".mp4", ".mpg", ".avi", ".mov"]:
             return FileType.VIDEO
         return FileType.UNKNOWN
 
 
-class App:
-    def __init__(self, r, f, db):
-        self.root = r
-        self.filelist = f
-        self.db = db
+def fit_size(size, w, h):
+    imgWidth, imgHeight = size
+    if imgWidth > w or imgHeight > h:
+        ratio = min(w / imgWidth, h / imgHeight)
+        return max(1, int(imgWidth * ratio)), max(1, int(imgHeight * ratio))
+    return imgWidth, imgHeight
 
-        self.w, self.h = r.winfo_width(), r.winfo_height()
-        self.input_image = None
-        self.image = None
-        self.canvas_image = None
-        self.video_player = None
-        self.keywordOutput = []
 
-        # Let's keep all class variables here in one place.
-        self.canvas = tkinter.Canvas(
-            self.root,
-            width=self.w,
-            height=self.h,
-            highlightthickness=0,
-            background="black",
-        )
-        self.canvas_visible = True
-        self.filename_label = tkinter.Label(
-            self.root, font=("Arial", self.w // 80), bg="gray"
-        )
-        self.filename_visible = False
-        self.metadataFrame = tkinter.Frame(self.root, bg="black")
-        self.video_frame = tkinter.Frame(self.root, bg="black")
-        self.rating = tkinter.Label(
-            self.metadataFrame,
-            font=("Arial", self.w // 80),
-            bg="black",
-            fg="yellow",
-            anchor=tkinter.E,
-        )
+def scale_to_fit(input_image, w, h, fast=False):
+    target = fit_size(input_image.size, w, h)
+    if target != input_image.size:
+        if fast:
+            # A preview: box-reduce to within 2x and finish with a bilinear pass.
+            return input_image.resize(target, Image.BILINEAR, reducing_gap=2.0)
+        # reducing_gap lets Pillow box-reduce by an integer factor before the
+        # Lanczos pass, so the expensive filter only runs on a small image.
+        return input_image.resize(target, Image.LANCZOS, reducing_gap=3.0)
 
-        self.keywordText = tkinter.StringVar()
-        self.keywordEntry = tkinter.Entry(
-            self.root,
-            font=("Arial", self.w // 80),
-            bg="black",
-            fg="white",
-            insertbackground="white",
-            textvariable=self.keywordText,
-        )
+    return input_image
 
-        self.__createWidgets()
-        self.__bindRootEvents()
-        self.__updateDisplay()
 
-        self.keywordDictionary = list(db.initialKeywords) if self.db else []
-        self.detect_pressed_filled = False
+def decode_heic(filename):
+    import pyheif
 
-    def __bindRootEvents(self) -> None:
-        self.root.bind("<Escape>", self.__exitCB)
-        self.root.bind("<Right>", self.__nextCB)
-        self.root.bind("<Left>", self.__prevCB)
-        self.root.bind("<p>", self.__togglePlayCB)
-        self.root.bind("<r>", self.__restartCB)
-        self.root.bind("<t>", self.__toggleFilenameCB)
-        if self.db:
-            self.root.bind("<s>", self.__saveDBCB)
-            self.root.bind("0", self.__setRatingCB)
-            self.root.bind("1", self.__setRatingCB)
-            self.root.bind("2", self.__setRatingCB)
-            self.root.bind("3", self.__setRatingCB)
-            self.root.bind("4", self.__setRatingCB)
-            self.root.bind("5", self.__setRatingCB)
-            self.root.bind("6", self.__setRatingCB)
-            self.root.bind("7", self.__setRatingCB)
-            self.root.bind("8", self.__setRatingCB)
-            self.root.bind("9", self.__setRatingCB)
-            self.root.bind("-", self.__setRatingCB)
-            self.root.bind("+", self.__setRatingCB)
-            self.root.bind("#", self.__showKeywordEntryCB)
-            self.root.bind("!", self.__showKeywordEntryCB)
-            self.root.bind("@", self.__showKeywordEntryCB)
+    with PROFILER.span("decode", ".heic"):
+        heif_file = pyheif.read(filename)
+    # frombuffer shares the decoded planes instead of copying them, which
+    # halves the peak memory of a full-size HEIC decode.
+    input_image = Image.frombuffer(
+        heif_file.mode,
+        heif_file.size,
+        heif_file.data,
+        "raw",
+        heif_file.mode,
+        heif_file.stride,
+        1,
+    )
+    return input_image
 
-    def __createWidgets(self) -> None:
 
-        self.canvas.place(relx=0, rely=0, anchor=tkinter.NW, relwidth=1, relheight=1)
-        self.metadataFrame.place(relx=1, rely=0, anchor=tkinter.NE)
+def decode_image(filename, w, h):
+    """Decode and orient an image that is to be shown at WxH.
 
-        if self.db:
-            self.rating.pack(fill="x")
+    JPEGs are decoded with DCT scaling at the smallest power-of-two reduction
+    that is still at least as large as the display size, so the full-resolution
+    raster is only materialized when the image is not much bigger than WxH.
+    """
+    extension = Path(filename).suffix.lower()
+    if extension == ".heic":
+        return decode_heic(filename)
+    with PROFILER.span("open", extension):
+        input_image = Image.open(filename)
+        if input_image.width * input_image.height > ZOOM_DECODE_PIXELS and (
+            RawTileSource.supports(input_image)
+        ):
+            # Huge uncompressed rasters are reduced strip by strip as they are read.
+            factor = 1
+            while (
+                input_image.width // (factor * 2) >= w
+                and input_image.height // (factor * 2) >= h
+            ):
+                factor *= 2
+            input_image.close()
+            with PROFILER.span("decode", extension):
+                return RawTileSource(filename).reduced(factor)
+        if METADATA.enabled:
+            orientation = image_orientation(filename)
+        else:
+            orientation = input_image.getexif().get(EXIF_ORIENTATION, 1)
+        # Orientations 5-8 rotate by 90 degrees, so fit the transposed box.
+        box = (h, w) if orientation in (5, 6, 7, 8) else (w, h)
+        target = fit_size(input_image.size, *box)
+        if target != input_image.size:
+            input_image.draft(input_image.mode, target)
+    with PROFILER.span("decode", extension):
+        input_image.load()
+    with PROFILER.span("exif_transpose", extension):
+        # The orientation is already known: transpose without parsing the EXIF again.
+        method = ORIENTATION_TRANSPOSE.get(orientation)
+        return input_image if method is None else input_image.transpose(method)
 
-        self.keywordEntry.bind("<Return>", self.__keywordEntryAcceptCB)
-        self.keywordEntry.bind("<Escape>", self.__keywordEntryCancelCB)
-        self.keywordEntry.bind("<KeyRelease>", self.__keywordEntryKeyreleaseCB)
-        self.keywordEntry.bind("<Key>", self.__keywordEntryKeypressCB)
 
-    def __setFrameHandle(self, _bus, message, frame_id) -> None:
-        if (
-            message.get_structure() is not None
-            and message.get_structure().get_name() == "prepare-window-handle"
-        ):
-            video_frame = message.src
-            video_frame.set_property("force-aspect-ratio", True)
-            video_frame.set_window_handle(frame_id)
+def load_image(filename, w, h, fast=False):
+    """Decode, orient and scale an image to fit WxH. Safe to call off the Tk thread.
 
-    def __setVideo(self, filename) -> None:
-        self.__setvideoframe()
-        file_abs_path = Path(filename).absolute().as_uri()
-        if self.video_player is None:
-            self.video_player=Gst.parse_launch('playbin uri='+file_abs_path+' video-sink= "videoflip method=automatic ! autovideosink"')
-            self.video_player.set_state(Gst.State.PLAYING)
-            self.bus = self.video_player.get_bus()
-            self.bus.enable_sync_message_emission()
-            self.bus.connect(
-                "sync-message::element", self.__setFrameHandle, self.frame_id
-            )
+    With `fast`, a cheap filter is used for the scaling, for a preview.
+    """
+    input_image = decode_image(filename, w, h)
+    with PROFILER.span("preview" if fast else "resize", Path(filename).suffix.lower()):
+        scaled_image = scale_to_fit(input_image, w, h, fast)
+    scaled_image.load()
+    return scaled_image
+
+
+def image_orientation(filename) -> int:
+    """EXIF orientation from the file header; HEIC and video are oriented by their decoders."""
+    extension = Path(filename).suffix.lower()
+    if extension == ".heic" or FileType.getType(extension) == FileType.VIDEO:
+        return 1
+    if METADATA.enabled:
+        metadata = METADATA.get(filename)
+        if metadata is not None:
+            return metadata.orientation
+    with Image.open(filename) as header:
+        return header.getexif().get(EXIF_ORIENTATION, 1)
+
+
+def parse_exif_time(value):
+    """Seconds since the epoch of an EXIF "YYYY:MM:DD HH:MM:SS" local time, or None."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(
+            value.strip("\x00 ")[:19], "%Y:%m:%d %H:%M:%S"
+        ).timestamp()
+    except ValueError:
+        return None
+
+
+def exif_metadata(exif, size=(None, None), orientation=None) -> Metadata:
+    # Pillow < 8.2 has no get_ifd() and returns the Exif IFD as a dict instead.
+    ifd = exif.get_ifd(EXIF_IFD) if hasattr(exif, "get_ifd") else exif.get(EXIF_IFD)
+    taken = (ifd or {}).get(EXIF_DATE_TIME_ORIGINAL) or exif.get(EXIF_DATE_TIME)
+    model = exif.get(EXIF_MODEL)
+    return Metadata(
+        taken=parse_exif_time(taken),
+        orientation=orientation or exif.get(EXIF_ORIENTATION, 1),
+        width=size[0],
+        height=size[1],
+        model=model.strip("\x00 ") if isinstance(model, str) else None,
+    )
+
+
+def iso_boxes(fp, start, end):
+    """Yield (type, payload start, end) of the ISO BMFF boxes in fp between start and end.
+
+    Only box headers are read; payloads such as the media data are seeked over.
+    """
+    offset = start
+    while offset + 8 <= end:
+        fp.seek(offset)
+        header = fp.read(16)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1 and len(header) == 16:
+            (size,) = struct.unpack(">Q", header[8:])
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield kind, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def iso_child(fp, start, end, kind):
+    for child, child_start, child_end in iso_boxes(fp, start, end):
+        if child == kind:
+            return child_start, child_end
+    return None
+
+
+def mp4_creation_time(filename):
+    """Creation time from the movie header (mvhd) of an MP4/MOV file, or None."""
+    with open(filename, "rb") as fp:
+        end = os.fstat(fp.fileno()).st_size
+        moov = iso_child(fp, 0, end, b"moov")
+        mvhd = moov and iso_child(fp, *moov, b"mvhd")
+        if not mvhd:
+            return None
+        fp.seek(mvhd[0])
+        header = fp.read(12)
+        if header[0] == 1:
+            (created,) = struct.unpack(">Q", header[4:12])
         else:
-            self.video_player.set_state(Gst.State.NULL)
-            self.video_player.set_property("uri", file_abs_path)
-            self.video_player.set_state(Gst.State.PLAYING)
+            (created,) = struct.unpack(">I", header[4:8])
+    # Cameras that do not know the time write 0 (1904-01-01).
+    return created - MP4_EPOCH_OFFSET if created else None
 
-    def __setvideoframe(self):
-        if self.canvas_visible:
-            self.video_frame.place(
-                relx=0, rely=0, anchor=tkinter.NW, relwidth=1, relheight=1
-            )
-            self.frame_id = self.video_frame.winfo_id()
-            self.canvas.place_forget()
-            self.canvas_visible = False
 
-    def __resize_image(self, input_image):
-        imgWidth, imgHeight = input_image.size
-        if imgWidth > self.w or imgHeight > self.h:
-            ratio = min(self.w / imgWidth, self.h / imgHeight)
-            imgWidth = int(imgWidth * ratio)
-            imgHeight = int(imgHeight * ratio)
-            return input_image.resize((imgWidth, imgHeight), Image.ANTIALIAS)
+def heic_metadata(filename) -> Metadata:
+    """Metadata from the Exif item of a HEIC file, located through its meta box."""
+    with open(filename, "rb") as fp:
+        end = os.fstat(fp.fileno()).st_size
+        meta = iso_child(fp, 0, end, b"meta")
+        if not meta:
+            return Metadata()
+        # meta is a full box: skip its version and flags.
+        start, stop = meta[0] + 4, meta[1]
+        iinf = iso_child(fp, start, stop, b"iinf")
+        iloc = iso_child(fp, start, stop, b"iloc")
+        if not iinf or not iloc:
+            return Metadata()
+        exif_id = None
+        fp.seek(iinf[0])
+        version = fp.read(4)[0]
+        entries = iinf[0] + (6 if version == 0 else 8)
+        for kind, infe_start, infe_end in iso_boxes(fp, entries, iinf[1]):
+            fp.seek(infe_start)
+            infe = fp.read(min(16, infe_end - infe_start))
+            if kind != b"infe" or infe[0] < 2:
+                continue
+            if infe[0] == 2:
+                item_id, item_type = struct.unpack(">H", infe[4:6])[0], infe[8:12]
+            else:
+                item_id, item_type = struct.unpack(">I", infe[4:8])[0], infe[10:14]
+            if item_type == b"Exif":
+                exif_id = item_id
+                break
+        if exif_id is None:
+            return Metadata()
+        fp.seek(iloc[0])
+        location = heic_item_location(fp.read(iloc[1] - iloc[0]), exif_id)
+        if location is None:
+            return Metadata()
+        fp.seek(location[0])
+        data = fp.read(location[1])
+    # The Exif item starts with the offset of the TIFF header.
+    (skip,) = struct.unpack(">I", data[:4])
+    exif = Image.Exif()
+    exif.load(data[4 + skip :])
+    # HEIC decoders apply the rotation themselves, see image_orientation().
+    return exif_metadata(exif, orientation=1)
 
-        return input_image
 
-    def __setImage(self, filename) -> None:
+def heic_item_location(iloc, item_id):
+    """(offset, length) of the first extent of item_id in an iloc box payload."""
+    version = iloc[0]
+    offset_size, length_size = iloc[4] >> 4, iloc[4] & 15
+    base_offset_size = iloc[5] >> 4
+    index_size = iloc[5] & 15 if version in (1, 2) else 0
+    position = 6
+
+    def read(size):
+        nonlocal position
+        value = int.from_bytes(iloc[position : position + size], "big")
+        position += size
+        return value
+
+    count = read(2 if version < 2 else 4)
+    for _ in range(count):
+        current = read(2 if version < 2 else 4)
+        if version in (1, 2):
+            read(2)  # construction method
+        read(2)  # data reference index
+        base_offset = read(base_offset_size)
+        extents = []
+        for _ in range(read(2)):
+            read(index_size)
+            extents.append((base_offset + read(offset_size), read(length_size)))
+        if current == item_id and extents:
+            return extents[0]
+    return None
+
+
+def read_metadata(filename) -> Metadata:
+    """Capture time, orientation, dimensions and camera model, from headers only.
+
+    No pixels are decoded: Pillow stops reading JPEG/PNG/TIFF files at the
+    image data, and HEIC and MP4/MOV files are walked box by box.
+    """
+    extension = Path(filename).suffix.lower()
+    try:
+        if extension == ".heic":
+            return heic_metadata(filename)
+        if extension in (".mp4", ".mov"):
+            return Metadata(taken=mp4_creation_time(filename))
+        if FileType.getType(extension) == FileType.IMAGE:
+            with Image.open(filename) as header:
+                return exif_metadata(header.getexif(), header.size)
+    except (OSError, ValueError, SyntaxError, struct.error):
+        pass
+    return Metadata()
+
+
+class MetadataIndex:
+    """Header metadata of media files, cached in SQLite by path, size and mtime.
+
+    Disabled until open(). get_many() reads the headers of new and changed
+    files on a thread pool, since that mostly waits on the file system. The
+    most recently used METADATA_MEMORY_ENTRIES are also kept in memory.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.pool = None
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+
+    def open(self, filename) -> None:
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS metadata (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                taken REAL,
+                orientation INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                model TEXT
+            )"""
+        )
+        self.conn.commit()
+        self.pool = ThreadPoolExecutor(
+            max_workers=METADATA_WORKERS, thread_name_prefix="metadata"
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.conn is not None
+
+    def __lookup(self, path):
         try:
-            extension = Path(filename).suffix.lower()
-            if extension == ".heic":
-                heif_file = pyheif.read(filename)
-                input_image = Image.frombytes(
-                    heif_file.mode,
-                    heif_file.size,
-                    heif_file.data,
-                    "raw",
-                    heif_file.mode,
-                    heif_file.stride,
+            st = os.stat(path)
+        except OSError:
+            return None, None, False
+        with self.lock:
+            cached = self.memory.get(path)
+            if cached is not None and cached[0] == (st.st_size, st.st_mtime_ns):
+                self.memory.move_to_end(path)
+                return st, cached[1], False
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT taken, orientation, width, height, model FROM metadata"
+                " WHERE path=? AND size=? AND mtime=?",
+                (path, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+        if row is not None:
+            metadata = Metadata(*row)
+        else:
+            with PROFILER.span("metadata", Path(path).suffix.lower()):
+                metadata = read_metadata(path)
+        with self.lock:
+            self.memory[path] = ((st.st_size, st.st_mtime_ns), metadata)
+            while len(self.memory) > METADATA_MEMORY_ENTRIES:
+                self.memory.popitem(last=False)
+        return st, metadata, row is None
+
+    def get(self, path):
+        """Metadata of path, or None if it cannot be stat'ed."""
+        return self.get_many([path])[0]
+
+    def get_many(self, paths) -> list:
+        paths = [str(path) for path in paths]
+        if len(paths) > 1:
+            found = list(self.pool.map(self.__lookup, paths))
+        else:
+            found = [self.__lookup(path) for path in paths]
+        rows = [
+            (path, st.st_size, st.st_mtime_ns, *metadata)
+            for path, (st, metadata, new) in zip(paths, found)
+            if new
+        ]
+        if rows:
+            with self.lock:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
                 )
-                scaled_image = self.__resize_image(input_image)
-                self.image = ImageTk.PhotoImage(scaled_image)
-            else:
-                input_image = Image.open(filename)
-                input_image = ImageOps.exif_transpose(input_image)
-                scaled_image = self.__resize_image(input_image)
-                self.image = ImageTk.PhotoImage(scaled_image)
-        except Exception as e:
-            print("error loading image:" + filename)
-            print(e)
+                self.conn.commit()
+        return [metadata for _st, metadata, _new in found]
 
-    def __showImage(self) -> None:
-        if not self.canvas_visible:
-            if self.video_player is not None:
-                self.video_player.set_state(Gst.State.PAUSED)
-            self.canvas.place(
-                relx=0, rely=0, anchor=tkinter.NW, relwidth=1, relheight=1
-            )
-            self.video_frame.place_forget()
-            self.canvas_visible = True
-        if self.canvas_image is None:
-            self.canvas_image = self.canvas.create_image(
-                self.w / 2, self.h / 2, image=self.image
+
+METADATA = MetadataIndex()
+
+
+def open_tile_source(filename):
+    """The best TileSource for filename: libvips if installed, raw reads, or one decode."""
+    try:
+        import pyvips  # noqa: F401
+    except (ImportError, OSError):
+        pass
+    else:
+        return VipsTileSource(filename)
+    image = Image.open(filename)
+    try:
+        if RawTileSource.supports(image):
+            return RawTileSource(filename)
+    finally:
+        image.close()
+    return DraftTileSource(filename)
+
+
+class RawTileSource:
+    """Reads regions of uncompressed rasters (PPM, BMP, uncompressed TIFF) from disk.
+
+    A region is decoded by pointing Pillow's raw decoder at the bytes of its
+    rows and columns, so only the region is read and held in memory. Coarse
+    levels come from an overview that is built once by streaming the file in
+    strips of rows.
+    """
+
+    PIXEL_BYTES = {
+        "L": 1,
+        "P": 1,
+        "I;16": 2,
+        "I;16B": 2,
+        "RGB": 3,
+        "BGR": 3,
+        "RGBX": 4,
+        "BGRX": 4,
+        "RGBA": 4,
+        "BGRA": 4,
+        "CMYK": 4,
+    }
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.overview = None
+        image = Image.open(filename)
+        self.size = image.size
+        self.strips = [self.__strip(image, tile) for tile in image.tile]
+        image.close()
+        width, height = self.size
+        factor = 1
+        while (width // factor) * (height // factor) > ZOOM_OVERVIEW_PIXELS:
+            factor *= 2
+        self.overview_factor = factor
+
+    # Tiles are read as (codec, extents, offset, args) tuples, which is what
+    # every Pillow version stores in Image.tile.
+
+    @staticmethod
+    def __args(tile):
+        args = tile[3] if isinstance(tile[3], tuple) else (tile[3],)
+        return (args + (0, 1))[:3]
+
+    @classmethod
+    def supports(cls, image) -> bool:
+        return bool(image.tile) and all(
+            tile[0] == "raw"
+            and tile[1][0] == 0
+            and tile[1][2] == image.width
+            and cls.PIXEL_BYTES.get(cls.__args(tile)[0]) is not None
+            for tile in image.tile
+        )
+
+    def __strip(self, image, tile):
+        _codec, extents, offset, _args = tile
+        rawmode, stride, orientation = self.__args(tile)
+        pixel_bytes = self.PIXEL_BYTES[rawmode]
+        stride = stride or image.width * pixel_bytes
+        return (
+            extents[1],
+            extents[3],
+            offset,
+            rawmode,
+            stride,
+            orientation,
+            pixel_bytes,
+        )
+
+    def decode(self, box):
+        """The full resolution pixels of box, read straight from the file."""
+        x0, y0, x1, y1 = box
+        tiles = []
+        for strip in self.strips:
+            top, bottom, offset, rawmode, stride, orientation, pixel_bytes = strip
+            a, b = max(top, y0), min(bottom, y1)
+            if a >= b:
+                continue
+            # Bottom-up strips store the region's last row first.
+            row = bottom - b if orientation < 0 else a - top
+            tiles.append(
+                (
+                    "raw",
+                    (0, a - y0, x1 - x0, b - y0),
+                    offset + row * stride + x0 * pixel_bytes,
+                    (rawmode, stride, orientation),
+                )
             )
-        else:
-            self.canvas.itemconfig(self.canvas_image, image=self.image)
+        image = Image.open(self.filename)
+        image._size = (x1 - x0, y1 - y0)
+        image.tile = tiles
+        image.load()
+        return image
 
-    def __updateDisplay(self) -> None:
-        filename = str(self.filelist.current().name)
-        self.filename_label["text"] = filename
-        if not self.root.attributes("-fullscreen"):
-            self.root.title(filename)
+    def reduced(self, factor):
+        """The whole image reduced by factor, read in strips to bound memory."""
+        width, height = self.size
+        out = None
+        rows = max(factor, RAW_STRIP_BYTES // (width * 4) // factor * factor)
+        for y in range(0, height, rows):
+            strip = self.decode((0, y, width, min(height, y + rows))).reduce(factor)
+            if out is None:
+                out = Image.new(strip.mode, (-(-width // factor), -(-height // factor)))
+            out.paste(strip, (0, y // factor))
+        return out
 
-        if self.db:
-            df = self.db.photo_df
-            if filename in df.index:
-                numstars = self.__get_stars(filename, df)
-                self.__setKeywordOutput(df.at[filename, "keywords"])
-                print("Filename: " + filename)
-                print("Stars: " + str(numstars))
-                print("Keywords: " + df.loc[filename]["keywords"])
-            else:
-                self.rating["text"] = star[1]
-                self.__setKeywordOutput("")
+    def region(self, level, box):
+        scale = 1 << level
+        if scale >= self.overview_factor:
+            with self.lock:
+                if self.overview is None:
+                    self.overview = self.reduced(self.overview_factor)
+            factor = scale // self.overview_factor
+            x0, y0, x1, y1 = (v * factor for v in box)
+            w, h = self.overview.size
+            region = self.overview.crop((x0, y0, min(x1, w), min(y1, h)))
+            return region.reduce(factor) if factor > 1 else region
+        w, h = self.size
+        x0, y0, x1, y1 = (v * scale for v in box)
+        region = self.decode((x0, y0, min(x1, w), min(y1, h)))
+        return region.reduce(scale) if scale > 1 else region
 
-        if self.filelist.currentType() == FileType.IMAGE:
-            self.__setImage(filename)
-            self.__showImage()
-        elif self.filelist.currentType() == FileType.VIDEO:
-            self.__setVideo(filename)
 
-    def __get_stars(self, filename, df):
-        numstars = int(df.loc[filename]["rating"])
-        if (numstars >= -1) and (numstars <= 10):
-            self.rating["text"] = star[numstars + 1]
-        return numstars
+class DraftTileSource:
+    """Decodes the whole image once, at the largest JPEG draft scale within ZOOM_DECODE_PIXELS.
 
-    def __toggleFilenameCB(self, event=None) -> None:
-        if self.__is_relevant_event(event):
-            if self.filename_visible:
-                self.filename_label.place_forget()
-                self.filename_visible = False
-            else:
-                self.filename_label.place(relx=0.5, rely=0, anchor=tkinter.N)
-                self.filename_visible = True
+    Levels finer than the decoded one are upsampled, so detail beyond it is
+    only available for JPEGs small enough to decode at full resolution.
+    """
 
-    def __togglePlayCB(self, event=None) -> None:
-        if (
-            self.__is_relevant_event(event)
-            and self.filelist.currentType() == FileType.VIDEO
-        ):
-            (_ret, temp_state, _p_state) = self.video_player.get_state(
-                timeout=Gst.SECOND
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.levels = {}
+        image = Image.open(filename)
+        width, height = image.size
+        scale = 1
+        while (width // scale) * (height // scale) > ZOOM_DECODE_PIXELS and scale < 8:
+            scale *= 2
+        if scale > 1:
+            image.draft(image.mode, (width // scale, height // scale))
+        if image.width * image.height > ZOOM_DECODE_PIXELS:
+            raise ValueError(
+                "%dx%d is too large to zoom without pyvips" % (width, height)
             )
-            if temp_state == Gst.State.PLAYING:
-                self.video_player.set_state(Gst.State.PAUSED)
-            elif temp_state == Gst.State.PAUSED:
-                self.video_player.set_state(Gst.State.PLAYING)
+        image.load()
+        self.base_scale = max(1, round(width / image.width))
+        self.base = ImageOps.exif_transpose(image)
+        self.size = (
+            self.base.width * self.base_scale,
+            self.base.height * self.base_scale,
+        )
+
+    def __level(self, factor):
+        with self.lock:
+            image = self.levels.get(factor)
+            if image is None:
+                image = self.levels[factor] = self.base.reduce(factor)
+            return image
+
+    def region(self, level, box):
+        scale = 1 << level
+        if scale >= self.base_scale:
+            factor = scale // self.base_scale
+            image = self.base if factor == 1 else self.__level(factor)
+            return image.crop(box)
+        up = self.base_scale // scale
+        x0, y0, x1, y1 = box
+        return self.base.resize(
+            (x1 - x0, y1 - y0), Image.BILINEAR, box=(x0 / up, y0 / up, x1 / up, y1 / up)
+        )
+
+
+class VipsTileSource:
+    """Region decoding through libvips, used when pyvips is installed."""
+
+    def __init__(self, filename):
+        import pyvips
+
+        self.base = pyvips.Image.new_from_file(filename, access="random").autorot()
+        self.size = (self.base.width, self.base.height)
+        self.levels = {0: self.base}
+        self.lock = threading.Lock()
+
+    def __level(self, level):
+        with self.lock:
+            image = self.levels.get(level)
+            if image is None:
+                image = self.levels[level] = self.base.shrink(1 << level, 1 << level)
+            return image
+
+    def region(self, level, box):
+        image = self.__level(level)
+        x0, y0, x1, y1 = box
+        region = image.crop(
+            x0, y0, min(x1, image.width) - x0, min(y1, image.height) - y0
+        )
+        if region.format != "uchar":
+            region = region.cast("uchar")
+        mode = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}[region.bands]
+        return Image.frombuffer(
+            mode,
+            (region.width, region.height),
+            region.write_to_memory(),
+            "raw",
+            mode,
+            0,
+            1,
+        )
+
+
+class TiledImage:
+    """Tile pyramid over a tile source.
+
+    Level k is the image reduced by 2**k, cut into TILE_SIZE squares; the
+    coarsest level fits in one tile. Tiles are kept in a shared ImageCache
+    keyed by (filename, level, column, row).
+    """
+
+    def __init__(self, filename, cache):
+        self.filename = filename
+        self.cache = cache
+        self.source = open_tile_source(filename)
+        self.size = self.source.size
+        self.levels = 1
+        while max(self.size) > TILE_SIZE << (self.levels - 1):
+            self.levels += 1
+
+    def level_size(self, level):
+        return tuple(-(-v >> level) for v in self.size)
+
+    def key(self, level, column, row):
+        return (self.filename, level, column, row)
+
+    def load(self, level, column, row):
+        w, h = self.level_size(level)
+        box = (
+            column * TILE_SIZE,
+            row * TILE_SIZE,
+            min(w, (column + 1) * TILE_SIZE),
+            min(h, (row + 1) * TILE_SIZE),
+        )
+        with PROFILER.span("tile", Path(self.filename).suffix.lower()):
+            tile = self.source.region(level, box)
+            tile.load()
+        self.cache.put(self.key(level, column, row), tile)
+        return tile
+
+
+class RenderCache:
+    """Persistent store of screen-sized renders in a single SQLite file.
+
+    Entries are keyed by absolute path, file size, mtime, target WxH and EXIF
+    orientation, stored JPEG/PNG encoded, and evicted least recently used
+    once the total blob size exceeds max_bytes.
+    """
+
+    def __init__(self, filename, max_bytes):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS renders (
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                orientation INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                atime REAL NOT NULL,
+                PRIMARY KEY (path, size, mtime, width, height, orientation)
+            )"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS renders_atime ON renders (atime)"
+        )
+        self.conn.commit()
+        (total,) = self.conn.execute(
+            "SELECT COALESCE(SUM(nbytes), 0) FROM renders"
+        ).fetchone()
+        self.bytes = total
+
+    @staticmethod
+    def key(filename, w, h) -> tuple:
+        path = Path(filename).absolute()
+        st = path.stat()
+        return (str(path), st.st_size, st.st_mtime_ns, w, h, image_orientation(path))
+
+    @staticmethod
+    def encode(image) -> bytes:
+        out = io.BytesIO()
+        if image.mode in ("RGB", "L"):
+            image.save(out, "JPEG", quality=92)
+        else:
+            image.save(out, "PNG", compress_level=1)
+        return out.getvalue()
+
+    @staticmethod
+    def decode(data):
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    def __contains__(self, key) -> bool:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM renders WHERE path=? AND size=? AND mtime=?"
+                " AND width=? AND height=? AND orientation=?",
+                key,
+            ).fetchone()
+        return row is not None
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM renders WHERE path=? AND size=? AND mtime=?"
+                " AND width=? AND height=? AND orientation=?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE renders SET atime=? WHERE path=? AND size=? AND mtime=?"
+                " AND width=? AND height=? AND orientation=?",
+                (time.time(), *key),
+            )
+            self.conn.commit()
+        return self.decode(row[0])
+
+    def put_encoded(self, key, data) -> None:
+        with self.lock:
+            path, _size, _mtime, w, h, _orientation = key
+            # Renders of an older version of the same file can never hit again.
+            stale = self.conn.execute(
+                "SELECT COALESCE(SUM(nbytes), 0) FROM renders"
+                " WHERE path=? AND width=? AND height=?",
+                (path, w, h),
+            ).fetchone()[0]
+            self.conn.execute(
+                "DELETE FROM renders WHERE path=? AND width=? AND height=?",
+                (path, w, h),
+            )
+            self.conn.execute(
+                "INSERT INTO renders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, data, len(data), time.time()),
+            )
+            self.bytes += len(data) - stale
+            if self.bytes > self.max_bytes:
+                self.__evict(self.max_bytes * 9 // 10)
+            self.conn.commit()
+
+    def put(self, key, image) -> None:
+        self.put_encoded(key, self.encode(image))
+
+    def __evict(self, target) -> None:
+        rows = self.conn.execute(
+            "SELECT rowid, nbytes FROM renders ORDER BY atime"
+        )
+        doomed = []
+        for rowid, nbytes in rows:
+            if self.bytes <= target:
+                break
+            doomed.append((rowid,))
+            self.bytes -= nbytes
+        self.conn.executemany("DELETE FROM renders WHERE rowid=?", doomed)
+
+
+def extract_poster(filename, w, h):
+    """Decode one frame, 10% into a video, scaled to fit WxH. Needs no display."""
+    Gst = gst()
+    uri = Path(filename).absolute().as_uri()
+    # flags=1 plays the video stream only, so no audio device is opened.
+    pipeline = Gst.parse_launch(
+        "playbin uri=" + uri + " flags=1"
+        ' video-sink="videoconvert ! videoflip method=automatic ! videoscale'
+        ' ! video/x-raw,format=RGB,pixel-aspect-ratio=1/1 ! appsink name=sink sync=false"'
+    )
+    sink = pipeline.get_property("video-sink").get_by_name("sink")
+    try:
+        pipeline.set_state(Gst.State.PAUSED)
+        if pipeline.get_state(POSTER_TIMEOUT)[0] != Gst.StateChangeReturn.SUCCESS:
+            return None
+        ok, duration = pipeline.query_duration(Gst.Format.TIME)
+        if ok and duration > 0:
+            pipeline.seek_simple(
+                Gst.Format.TIME,
+                Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
+                duration // 10,
+            )
+            pipeline.get_state(POSTER_TIMEOUT)
+        sample = sink.emit("pull-preroll")
+        if sample is None:
+            return None
+        structure = sample.get_caps().get_structure(0)
+        width = structure.get_value("width")
+        height = structure.get_value("height")
+        buffer = sample.get_buffer()
+        data = buffer.extract_dup(0, buffer.get_size())
+        # GStreamer pads RGB rows to a multiple of 4 bytes.
+        image = Image.frombuffer(
+            "RGB", (width, height), data, "raw", "RGB", len(data) // height, 1
+        )
+        poster = scale_to_fit(image, w, h)
+        poster.load()
+        return poster
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def render_poster(filename, w, h, render_cache=None):
+    """extract_poster() backed by the on-disk RenderCache, if one is configured."""
+    if render_cache is None:
+        return extract_poster(filename, w, h)
+    key = RenderCache.key(filename, w, h)
+    image = render_cache.get(key)
+    if image is None:
+        with PROFILER.span("poster", Path(filename).suffix.lower()):
+            image = extract_poster(filename, w, h)
+        if image is not None:
+            render_cache.put(key, image)
+    return image
+
+
+def render_image(filename, w, h, render_cache=None):
+    """load_image() backed by the on-disk RenderCache, if one is configured."""
+    if render_cache is None:
+        return load_image(filename, w, h)
+    key = RenderCache.key(filename, w, h)
+    with PROFILER.span("render_cache", Path(filename).suffix.lower()):
+        image = render_cache.get(key)
+    if image is None:
+        image = load_image(filename, w, h)
+        render_cache.put(key, image)
+    return image
+
+
+def _render_for_cache(key):
+    filename, _size, _mtime, w, h, _orientation = key
+    try:
+        return key, RenderCache.encode(load_image(filename, w, h))
+    except Exception as e:
+        print("error loading image:" + filename)
+        print(e)
+        return key, None
+
+
+def rebuild_render_cache(f, render_cache, w, h) -> None:
+    keys = []
+    for path in f.filelist:
+        if FileType.getType(path.suffix) != FileType.IMAGE:
+            continue
+        try:
+            key = RenderCache.key(path, w, h)
+        except Exception as e:
+            print("error reading image:" + str(path))
+            print(e)
+            continue
+        if key not in render_cache:
+            keys.append(key)
+    print("Rendering %d files at %dx%d" % (len(keys), w, h))
+    with ProcessPoolExecutor() as pool:
+        for done, (key, data) in enumerate(
+            pool.map(_render_for_cache, keys, chunksize=4), 1
+        ):
+            if data is not None:
+                render_cache.put_encoded(key, data)
+            if done % 100 == 0:
+                print("%d/%d" % (done, len(keys)))
+    print("finished rendering")
+
+
+class ImageCache:
+    """LRU cache of scaled images, bounded by the total size of their pixel data."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def image_bytes(image) -> int:
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key):
+        with self.lock:
+            image = self.entries.get(key)
+            if image is not None:
+                self.entries.move_to_end(key)
+            return image
+
+    def __contains__(self, key) -> bool:
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key, image) -> None:
+        nbytes = self.image_bytes(image)
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= self.image_bytes(old)
+            self.entries[key] = image
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _key, evicted = self.entries.popitem(last=False)
+                self.bytes -= self.image_bytes(evicted)
+
+    def retain(self, predicate) -> None:
+        with self.lock:
+            for key in [k for k in self.entries if not predicate(k)]:
+                self.bytes -= self.image_bytes(self.entries.pop(key))
+
+
+class Prefetcher:
+    """Decodes and scales the images around the current FileList entry on a worker pool.
+
+    Results are keyed by (path, width, height) in an ImageCache so that stepping
+    forwards and backwards only has to convert an already-scaled image for Tk.
+    Poster frames of videos are keyed by (path, width, height, "poster"). Once
+    extract_posters() has been called, the ones near the current entry are
+    extracted with the images, and a separate single worker fills the
+    RenderCache with the rest of the FileList.
+    """
+
+    def __init__(self, cache, ahead=3, behind=1, workers=None, render_cache=None):
+        self.cache = cache
+        self.render_cache = render_cache
+        self.ahead = ahead
+        self.behind = behind
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers or min(4, os.cpu_count() or 1),
+            thread_name_prefix="prefetch",
+        )
+        self.poster_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="posters"
+        )
+        # Refinements of the image on screen do not queue behind prefetches.
+        self.refine_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="refine"
+        )
+        self.poster_size = None
+        # Off until a video is shown or the grid opens, as extracting a
+        # poster loads GStreamer.
+        self.posters = False
+        self.pending = {}
+        self.lock = threading.RLock()
+
+    def __load(self, key):
+        filename, w, h = key[:3]
+        if len(key) == 4:
+            image = render_poster(filename, w, h, self.render_cache)
+        else:
+            image = render_image(filename, w, h, self.render_cache)
+        if image is not None:
+            self.cache.put(key, image)
+        return image
+
+    def __done(self, key, _future) -> None:
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def __submit(self, key):
+        future = self.pool.submit(self.__load, key)
+        self.pending[key] = future
+        future.add_done_callback(lambda fut: self.__done(key, fut))
+        return future
+
+    def preview(self, filename, w, h):
+        """Return (image, source) for showing filename now.
+
+        A cached, pending or render-cached image is final and source is None.
+        Otherwise the image is scaled with a cheap filter and source is the
+        decoded image to pass to refine().
+        """
+        key = (str(filename), w, h)
+        image = self.cache.get(key)
+        if image is not None:
+            return image, None
+        with self.lock:
+            future = self.pending.get(key)
+        if future is not None and not future.cancel():
+            return future.result(), None
+        if self.render_cache is not None:
+            image = self.render_cache.get(RenderCache.key(filename, w, h))
+            if image is not None:
+                self.cache.put(key, image)
+                return image, None
+        source = decode_image(filename, w, h)
+        with PROFILER.span("preview", Path(filename).suffix.lower()):
+            image = scale_to_fit(source, w, h, fast=True)
+            image.load()
+        return image, source
+
+    def __refine(self, filename, source, w, h):
+        with PROFILER.span("refine", Path(filename).suffix.lower()):
+            image = scale_to_fit(source, w, h)
+            image.load()
+        self.cache.put((str(filename), w, h), image)
+        if self.render_cache is not None:
+            self.render_cache.put(RenderCache.key(filename, w, h), image)
+        return image
+
+    def refine(self, filename, source, w, h):
+        """Start the full quality scaling of a preview's source; returns its future."""
+        return self.refine_pool.submit(self.__refine, filename, source, w, h)
+
+    def poster(self, filename, w, h):
+        """The poster frame of a video if it has been extracted, without blocking."""
+        key = (str(filename), w, h, "poster")
+        image = self.cache.get(key)
+        if image is None and self.render_cache is not None:
+            image = self.render_cache.get(RenderCache.key(filename, w, h))
+            if image is not None:
+                self.cache.put(key, image)
+        return image
+
+    def __extract_posters(self, filelist, w, h) -> None:
+        filelist.wait()
+        with filelist.lock:
+            current = filelist.file_index
+            videos = [
+                (abs(index - current), path)
+                for index, path in enumerate(filelist.filelist)
+                if FileType.getType(path.suffix) == FileType.VIDEO
+            ]
+        for _distance, path in sorted(videos):
+            if self.poster_size != (w, h):
+                return
+            try:
+                if RenderCache.key(path, w, h) not in self.render_cache:
+                    render_poster(path, w, h, self.render_cache)
+            except Exception as e:
+                print("error extracting poster:" + str(path))
+                print(e)
+
+    def extract_posters(self, filelist, w, h) -> None:
+        """Start extracting posters for every video in filelist into the RenderCache, nearest first."""
+        self.posters = True
+        if self.render_cache is None or self.poster_size == (w, h):
+            return
+        self.poster_size = (w, h)
+        self.poster_pool.submit(self.__extract_posters, filelist, w, h)
+
+    def schedule(self, filelist, w, h) -> None:
+        wanted = []
+        for path in filelist.neighbors(self.ahead, self.behind):
+            filetype = FileType.getType(path.suffix)
+            if filetype == FileType.IMAGE:
+                wanted.append((str(path), w, h))
+            elif filetype == FileType.VIDEO and self.posters:
+                wanted.append((str(path), w, h, "poster"))
+        with self.lock:
+            for key, future in list(self.pending.items()):
+                if key not in wanted:
+                    future.cancel()
+            for key in wanted:
+                if key not in self.pending and key not in self.cache:
+                    self.__submit(key)
+
+    def resize(self, w, h) -> None:
+        self.cache.retain(lambda key: key[1:3] == (w, h))
+
+    def shutdown(self) -> None:
+        self.poster_size = None
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.refine_pool.shutdown(wait=False, cancel_futures=True)
+        self.poster_pool.shutdown(wait=False, cancel_futures=True)
+
+
+class VideoPipeline:
+    """A playbin that renders into its own Tk frame, prerolled to PAUSED on creation."""
+
+    def __init__(self, root, uri):
+        Gst = gst()
+        self.uri = uri
+        self.played = False
+        self.frame = tkinter.Frame(root, bg="black")
+        self.frame_id = self.frame.winfo_id()
+        with PROFILER.span("video_launch", Path(uri).suffix.lower()):
+            self.player = Gst.parse_launch(
+                "playbin uri="
+                + uri
+                + ' video-sink= "videoflip method=automatic ! autovideosink"'
+            )
+            self.bus = self.player.get_bus()
+            self.bus.enable_sync_message_emission()
+            self.bus.connect("sync-message::element", self.__setFrameHandle)
+            self.player.set_state(Gst.State.PAUSED)
+
+    def __setFrameHandle(self, _bus, message) -> None:
+        if (
+            message.get_structure() is not None
+            and message.get_structure().get_name() == "prepare-window-handle"
+        ):
+            video_frame = message.src
+            video_frame.set_property("force-aspect-ratio", True)
+            video_frame.set_window_handle(self.frame_id)
+
+    def play(self) -> None:
+        Gst = gst()
+        with PROFILER.span("video_state", Path(self.uri).suffix.lower()):
+            if self.played:
+                self.player.seek_simple(
+                    Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, 0
+                )
+            self.player.set_state(Gst.State.PLAYING)
+        self.played = True
+
+    def pause(self) -> None:
+        self.player.set_state(gst().State.PAUSED)
+
+    def release(self) -> None:
+        self.player.set_state(gst().State.NULL)
+        self.frame.destroy()
+
+
+class VideoPool:
+    """Keeps the current video and the next one prerolled in separate pipelines.
+
+    Showing a prerolled video only needs a PAUSED -> PLAYING transition and a
+    frame swap. At most `limit` pipelines are kept; the least recently used
+    idle ones are set to NULL and released.
+    """
+
+    def __init__(self, root, limit=2):
+        self.root = root
+        self.limit = max(1, limit)
+        self.pipelines = OrderedDict()
+        self.current = None
+
+    def __get(self, uri) -> VideoPipeline:
+        pipeline = self.pipelines.pop(uri, None)
+        if pipeline is None:
+            pipeline = VideoPipeline(self.root, uri)
+        self.pipelines[uri] = pipeline
+        return pipeline
+
+    def __trim(self) -> None:
+        for uri in list(self.pipelines):
+            if len(self.pipelines) <= self.limit:
+                break
+            if self.pipelines[uri] is not self.current:
+                self.pipelines.pop(uri).release()
+
+    def play(self, uri) -> VideoPipeline:
+        if self.current is not None and self.current.uri != uri:
+            self.current.pause()
+        self.current = self.__get(uri)
+        self.current.play()
+        self.__trim()
+        return self.current
+
+    def preroll(self, uri) -> None:
+        # Nothing is prerolled before the first video is shown, so GStreamer
+        # is not loaded (on the Tk thread) before it is needed.
+        if self.limit < 2 or self.current is None or uri in self.pipelines:
+            return
+        self.__get(uri)
+        self.__trim()
+
+    def pause(self) -> None:
+        if self.current is not None:
+            self.current.pause()
+
+    def release(self) -> None:
+        for pipeline in self.pipelines.values():
+            pipeline.release()
+        self.pipelines.clear()
+        self.current = None
+
+
+class DatabaseWriter:
+    """Runs db.save() on its own thread, so the UI never waits for a save.
+
+    Saves requested while one is running are coalesced into a single next
+    save. Progress and failures are queued on `messages` as (text, failed)
+    for the Tk thread to show.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Condition()
+        self.requested = False
+        self.saving = False
+        self.stopped = False
+        self.messages = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.__run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def request(self) -> None:
+        with self.lock:
+            self.requested = True
+            self.lock.notify_all()
+
+    @property
+    def busy(self) -> bool:
+        with self.lock:
+            return self.requested or self.saving
+
+    def __run(self) -> None:
+        while True:
+            with self.lock:
+                self.lock.wait_for(lambda: self.requested or self.stopped)
+                if not self.requested:
+                    return
+                self.requested = False
+                self.saving = True
+            self.messages.put(("Saving...", False))
+            try:
+                with PROFILER.span("db_save"):
+                    self.db.save()
+            except Exception as e:
+                print("Error: save failed: %s" % e)
+                self.messages.put(("Save failed: %s" % e, True))
+            else:
+                self.messages.put(
+                    ("Saved " + datetime.now().strftime("%H:%M:%S"), False)
+                )
+            finally:
+                with self.lock:
+                    self.saving = False
+                    self.lock.notify_all()
+
+    def shutdown(self) -> None:
+        """Finish the requested saves, then stop the thread."""
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+        self.thread.join()
+
+
+class GridCell:
+    """The canvas items of one grid slot and the FileList entry it shows."""
+
+    def __init__(self, canvas, font):
+        self.border = canvas.create_rectangle(0, 0, 0, 0, width=3, outline="")
+        self.image = canvas.create_image(0, 0, anchor=tkinter.CENTER)
+        self.placeholder = canvas.create_text(0, 0, fill="gray", font=font)
+        self.caption = canvas.create_text(
+            0, 0, anchor=tkinter.N, fill="white", font=font, justify=tkinter.CENTER
+        )
+        self.items = (self.border, self.image, self.placeholder, self.caption)
+        self.path = None
+        self.shown = None
+        self.photo = None
+
+
+class GridView:
+    """Scrollable grid of FileList thumbnails with their rating and keywords.
+
+    Only the slots that fit in the window exist: a fixed pool of GridCells is
+    pointed at different FileList entries as the grid scrolls, so a scroll
+    step costs the same and memory stays bounded however long the list is.
+    Thumbnails are decoded on a worker pool into a byte-bounded ImageCache
+    and drawn by a Tk timer as they arrive.
+    """
+
+    PADDING = 6
+
+    def __init__(self, root, filelist, db, size, cache_bytes, render_cache=None, on_close=None):
+        self.root = root
+        self.filelist = filelist
+        self.db = db
+        self.size = size
+        self.render_cache = render_cache
+        self.on_close = on_close
+        self.cache = ImageCache(cache_bytes)
+        self.pool = ThreadPoolExecutor(
+            max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="thumbnails"
+        )
+        self.pending = {}
+        self.failed = set()
+        self.visible = False
+        self.top = 0
+        self.cursor = 0
+        self.anchor = 0
+        self.selection = set()
+        self.columns = 1
+        self.cells = []
+        self.draw_scheduled = False
+        self.polling = False
+
+        self.font = ("Arial", max(8, size // 16))
+        self.cell_w = size + 2 * self.PADDING
+        self.cell_h = size + 2 * self.PADDING + 3 * self.font[1]
+        self.canvas = tkinter.Canvas(root, highlightthickness=0, background="black")
+        self.__bindEvents()
+
+    def __bindEvents(self) -> None:
+        for sequence, step in (
+            ("<Left>", -1),
+            ("<Right>", 1),
+            ("<Up>", "up"),
+            ("<Down>", "down"),
+            ("<Prior>", "page_up"),
+            ("<Next>", "page_down"),
+            ("<Home>", "home"),
+            ("<End>", "end"),
+        ):
+            self.canvas.bind(sequence, lambda e, s=step: self.__moveCB(e, s, False))
+            self.canvas.bind(
+                "<Shift-" + sequence[1:], lambda e, s=step: self.__moveCB(e, s, True)
+            )
+        self.canvas.bind("<space>", self.__toggleSelectCB)
+        self.canvas.bind("<Control-a>", self.__selectAllCB)
+        self.canvas.bind("<Return>", self.__openCB)
+        self.canvas.bind("<Escape>", self.__escapeCB)
+        self.canvas.bind("<g>", self.__closeCB)
+        self.canvas.bind("<Button-1>", self.__clickCB)
+        self.canvas.bind("<Control-Button-1>", self.__clickCB)
+        self.canvas.bind("<Shift-Button-1>", self.__clickCB)
+        self.canvas.bind("<Double-Button-1>", self.__openCB)
+        self.canvas.bind("<MouseWheel>", self.__wheelCB)
+        self.canvas.bind("<Button-4>", self.__wheelCB)
+        self.canvas.bind("<Button-5>", self.__wheelCB)
+        self.canvas.bind("<Configure>", self.__configureCB)
+
+    def owns(self, event) -> bool:
+        return self.visible and event.widget == self.canvas
+
+    def show(self) -> None:
+        self.visible = True
+        self.cursor = self.anchor = self.filelist.file_index
+        self.canvas.place(relx=0, rely=0, anchor=tkinter.NW, relwidth=1, relheight=1)
+        self.canvas.lift()
+        self.canvas.focus_set()
+        self.root.update_idletasks()
+        self.__layout()
+        self.__reveal()
+        self.__draw()
+
+    def hide(self) -> None:
+        self.visible = False
+        self.canvas.place_forget()
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        for cell in self.cells:
+            cell.photo = None
+            cell.shown = None
+            self.canvas.itemconfig(cell.image, image="")
+        self.root.focus_set()
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def targets(self) -> list:
+        """Filenames to rate or tag: the selection, or the file under the cursor."""
+        if self.selection:
+            return sorted(path.name for path in self.selection)
+        paths = self.filelist.entries(self.cursor, self.cursor + 1)
+        return [paths[0].name] if paths else []
+
+    def refresh(self) -> None:
+        """Redraw the captions, e.g. after ratings or keywords changed."""
+        for cell in self.cells:
+            cell.path = None
+        self.__scheduleDraw()
+
+    def __rows(self) -> int:
+        return max(1, self.canvas.winfo_height() // self.cell_h)
+
+    def __layout(self) -> None:
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        self.columns = max(1, width // self.cell_w)
+        # One extra row for the partly visible rows at the top and bottom.
+        needed = self.columns * (height // self.cell_h + 2)
+        while len(self.cells) < needed:
+            self.cells.append(GridCell(self.canvas, self.font))
+        while len(self.cells) > needed:
+            for item in self.cells.pop().items:
+                self.canvas.delete(item)
+        for cell in self.cells:
+            cell.path = None
+
+    def __reveal(self) -> None:
+        row_top = self.cursor // self.columns * self.cell_h
+        height = self.canvas.winfo_height()
+        if row_top < self.top:
+            self.top = row_top
+        elif row_top + self.cell_h > self.top + height:
+            self.top = row_top + self.cell_h - height
+
+    def __clampTop(self) -> None:
+        total_rows = -(-self.filelist.length // self.columns)
+        bottom = max(0, total_rows * self.cell_h - self.canvas.winfo_height())
+        self.top = min(max(0, self.top), bottom)
+
+    def __scheduleDraw(self) -> None:
+        if self.visible and not self.draw_scheduled:
+            self.draw_scheduled = True
+            self.root.after_idle(self.__draw)
+
+    def __draw(self) -> None:
+        self.draw_scheduled = False
+        if not self.visible:
+            return
+        self.__clampTop()
+        first = self.top // self.cell_h * self.columns
+        y0 = -(self.top % self.cell_h)
+        x0 = (self.canvas.winfo_width() - self.columns * self.cell_w) // 2
+        paths = self.filelist.entries(first, first + len(self.cells))
+        for slot, cell in enumerate(self.cells):
+            if slot >= len(paths):
+                for item in cell.items:
+                    self.canvas.itemconfig(item, state=tkinter.HIDDEN)
+                cell.path = None
+                continue
+            x = x0 + slot % self.columns * self.cell_w
+            y = y0 + slot // self.columns * self.cell_h
+            self.__drawCell(cell, paths[slot], first + slot, x, y)
+        self.__request(paths)
+
+    def __drawCell(self, cell, path, index, x, y) -> None:
+        cx, cy = x + self.cell_w // 2, y + self.PADDING + self.size // 2
+        self.canvas.coords(cell.border, x + 1, y + 1, x + self.cell_w - 1, y + self.cell_h - 1)
+        self.canvas.coords(cell.image, cx, cy)
+        self.canvas.coords(cell.placeholder, cx, cy)
+        self.canvas.coords(cell.caption, cx, y + 2 * self.PADDING + self.size)
+        for item in cell.items:
+            self.canvas.itemconfig(item, state=tkinter.NORMAL)
+        if index == self.cursor:
+            outline = "yellow"
+        elif path in self.selection:
+            outline = "dodger blue"
+        else:
+            outline = ""
+        self.canvas.itemconfig(cell.border, outline=outline)
+
+        if cell.path != path:
+            cell.path = path
+            self.canvas.itemconfig(cell.caption, text=self.__caption(path))
+        if cell.shown != path:
+            image = self.cache.get((str(path), self.size, self.size))
+            if image is not None:
+                cell.photo = ImageTk.PhotoImage(image)
+                cell.shown = path
+                self.canvas.itemconfig(cell.image, image=cell.photo)
+                self.canvas.itemconfig(cell.placeholder, text="")
+            else:
+                cell.photo = None
+                self.canvas.itemconfig(cell.image, image="")
+                if FileType.getType(path.suffix) == FileType.VIDEO:
+                    text = "▶"
+                elif path in self.failed:
+                    text = "?"
+                else:
+                    text = ""
+                self.canvas.itemconfig(cell.placeholder, text=text)
+
+    def __caption(self, path) -> str:
+        row = self.db.row(path.name) if self.db else None
+        if row is None:
+            return path.name
+        rating, keywords = row
+        stars = star.get(int(rating) + 1, "")
+        # Roughly one line of keywords at this font size.
+        limit = max(4, self.cell_w * 5 // (self.font[1] * 3))
+        if len(keywords) > limit:
+            keywords = keywords[: limit - 1] + "…"
+        return stars + "\n" + keywords
+
+    def __load(self, key):
+        if FileType.getType(Path(key[0]).suffix) == FileType.VIDEO:
+            image = render_poster(key[0], key[1], key[2], self.render_cache)
+            if image is None:
+                return None
+        else:
+            image = render_image(key[0], key[1], key[2], self.render_cache)
+        self.cache.put(key, image)
+        return image
+
+    def __request(self, paths) -> None:
+        wanted = [
+            (str(path), self.size, self.size)
+            for path in paths
+            if FileType.getType(path.suffix) in (FileType.IMAGE, FileType.VIDEO)
+            and path not in self.failed
+        ]
+        for key in list(self.pending):
+            if key not in wanted:
+                self.pending.pop(key).cancel()
+        for key in wanted:
+            if key not in self.pending and key not in self.cache:
+                self.pending[key] = self.pool.submit(self.__load, key)
+        if self.pending and not self.polling:
+            self.polling = True
+            self.root.after(30, self.__poll)
+
+    def __poll(self) -> None:
+        self.polling = False
+        done = [key for key, future in self.pending.items() if future.done()]
+        for key in done:
+            future = self.pending.pop(key)
+            if not future.cancelled() and future.exception() is not None:
+                print("error loading thumbnail:" + key[0])
+                print(future.exception())
+                self.failed.add(Path(key[0]))
+            elif not future.cancelled() and future.result() is None:
+                # A video without a poster frame keeps its "▶" placeholder.
+                self.failed.add(Path(key[0]))
+        if done:
+            self.__scheduleDraw()
+        elif self.pending and self.visible:
+            self.polling = True
+            self.root.after(30, self.__poll)
+
+    def __moveCB(self, _event, step, extend) -> str:
+        length = self.filelist.length
+        page = self.columns * self.__rows()
+        cursor = {
+            "up": self.cursor - self.columns,
+            "down": self.cursor + self.columns,
+            "page_up": self.cursor - page,
+            "page_down": self.cursor + page,
+            "home": 0,
+            "end": length - 1,
+        }.get(step, self.cursor + step if isinstance(step, int) else self.cursor)
+        self.cursor = min(max(0, cursor), length - 1)
+        if extend:
+            self.__selectRange()
+        else:
+            self.anchor = self.cursor
+        self.__reveal()
+        self.__scheduleDraw()
+        return "break"
+
+    def __selectRange(self) -> None:
+        low, high = sorted((self.anchor, self.cursor))
+        self.selection = set(self.filelist.entries(low, high + 1))
+
+    def __toggleSelectCB(self, _event) -> str:
+        for path in self.filelist.entries(self.cursor, self.cursor + 1):
+            self.selection ^= {path}
+        self.anchor = self.cursor
+        self.__scheduleDraw()
+        return "break"
+
+    def __selectAllCB(self, _event) -> str:
+        self.selection = set(self.filelist.entries(0, self.filelist.length))
+        self.__scheduleDraw()
+        return "break"
+
+    def __indexAt(self, x, y):
+        x0 = (self.canvas.winfo_width() - self.columns * self.cell_w) // 2
+        column = (x - x0) // self.cell_w
+        if not 0 <= column < self.columns:
+            return None
+        index = (y + self.top) // self.cell_h * self.columns + column
+        return index if index < self.filelist.length else None
+
+    def __clickCB(self, event) -> str:
+        self.canvas.focus_set()
+        index = self.__indexAt(event.x, event.y)
+        if index is None:
+            return "break"
+        self.cursor = index
+        if event.state & 0x0001:  # Shift
+            self.__selectRange()
+        elif event.state & 0x0004:  # Control
+            self.__toggleSelectCB(event)
+        else:
+            self.anchor = index
+            self.selection = set()
+        self.__scheduleDraw()
+        return "break"
+
+    def __wheelCB(self, event) -> str:
+        if event.num == 4 or event.delta > 0:
+            self.top -= self.cell_h // 2
+        else:
+            self.top += self.cell_h // 2
+        self.__scheduleDraw()
+        return "break"
+
+    def __openCB(self, event) -> str:
+        if event.type == tkinter.EventType.ButtonPress:
+            index = self.__indexAt(event.x, event.y)
+            if index is None:
+                return "break"
+            self.cursor = index
+        self.filelist.seek(self.cursor)
+        self.hide()
+        if self.on_close is not None:
+            self.on_close()
+        return "break"
+
+    def __escapeCB(self, event) -> str:
+        if self.selection:
+            self.selection = set()
+            self.__scheduleDraw()
+            return "break"
+        return self.__closeCB(event)
+
+    def __closeCB(self, _event) -> str:
+        self.hide()
+        if self.on_close is not None:
+            self.on_close()
+        return "break"
+
+    def __configureCB(self, _event) -> None:
+        if self.visible:
+            self.__layout()
+            self.__reveal()
+            self.__scheduleDraw()
+
+
+class ZoomView:
+    """Zoom and pan over one image, drawn from a TiledImage.
+
+    Only the tiles of the level that matches the zoom and intersect the
+    window are decoded, on a worker pool, along with a margin of tiles in the
+    direction of the last pan. Until a tile arrives its area shows the
+    coarsest level stretched over the window.
+    """
+
+    def __init__(self, root, cache_bytes, on_close=None):
+        self.root = root
+        self.on_close = on_close
+        self.cache = ImageCache(cache_bytes)
+        self.pool = ThreadPoolExecutor(
+            max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="tiles"
+        )
+        self.image = None
+        self.opening = None
+        self.visible = False
+        self.scale = 1.0
+        self.center = (0, 0)
+        self.direction = (0, 0)
+        self.drag = None
+        self.items = {}
+        self.pending = {}
+        self.background = None
+        self.background_item = None
+        self.draw_scheduled = False
+        self.polling = False
+        self.canvas = tkinter.Canvas(root, highlightthickness=0, background="black")
+        self.message = self.canvas.create_text(0, 0, fill="gray", font=("Arial", 16))
+        self.__bindEvents()
+
+    def __bindEvents(self) -> None:
+        for sequence, direction in (
+            ("<Left>", (-1, 0)),
+            ("<Right>", (1, 0)),
+            ("<Up>", (0, -1)),
+            ("<Down>", (0, 1)),
+        ):
+            self.canvas.bind(sequence, lambda e, d=direction: self.__panKeyCB(d))
+        for sequence in ("<plus>", "<equal>", "<KP_Add>"):
+            self.canvas.bind(sequence, lambda e: self.__zoomCB(ZOOM_STEP))
+        for sequence in ("<minus>", "<KP_Subtract>"):
+            self.canvas.bind(sequence, lambda e: self.__zoomCB(1 / ZOOM_STEP))
+        self.canvas.bind("<f>", self.__fitCB)
+        self.canvas.bind("<Escape>", self.__closeCB)
+        self.canvas.bind("<z>", self.__closeCB)
+        self.canvas.bind("<ButtonPress-1>", self.__dragStartCB)
+        self.canvas.bind("<B1-Motion>", self.__dragCB)
+        self.canvas.bind("<MouseWheel>", self.__wheelCB)
+        self.canvas.bind("<Button-4>", self.__wheelCB)
+        self.canvas.bind("<Button-5>", self.__wheelCB)
+        self.canvas.bind("<Configure>", lambda e: self.__scheduleDraw())
+
+    def show(self, filename) -> None:
+        self.visible = True
+        self.canvas.place(relx=0, rely=0, anchor=tkinter.NW, relwidth=1, relheight=1)
+        self.canvas.lift()
+        self.canvas.focus_set()
+        self.canvas.coords(
+            self.message, self.root.winfo_width() / 2, self.root.winfo_height() / 2
+        )
+        self.canvas.itemconfig(self.message, text="Loading " + Path(filename).name)
+        self.opening = self.pool.submit(self.__open, filename)
+        self.__waitForImage(self.opening)
+
+    def __open(self, filename):
+        image = TiledImage(filename, self.cache)
+        return image, image.load(image.levels - 1, 0, 0)
+
+    def __waitForImage(self, future) -> None:
+        if future is not self.opening:
+            return
+        if not future.done():
+            self.root.after(30, self.__waitForImage, future)
+            return
+        self.opening = None
+        try:
+            self.image, self.background = future.result()
+        except Exception as e:
+            self.canvas.itemconfig(self.message, text="Cannot zoom: " + str(e))
+            return
+        self.canvas.itemconfig(self.message, text="")
+        self.__fitCB()
+
+    def hide(self) -> None:
+        self.visible = False
+        self.opening = None
+        self.canvas.place_forget()
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.__clearTiles()
+        if self.background_item is not None:
+            self.canvas.delete(self.background_item)
+            self.background_item = None
+        self.image = self.background = None
+        self.root.focus_set()
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def owns(self, event) -> bool:
+        return self.visible and event.widget == self.canvas
+
+    def __clearTiles(self) -> None:
+        for item, _photo in self.items.values():
+            self.canvas.delete(item)
+        self.items.clear()
+
+    def __fitScale(self) -> float:
+        w, h = self.image.size
+        return min(self.canvas.winfo_width() / w, self.canvas.winfo_height() / h, 1.0)
+
+    def __setScale(self, scale) -> None:
+        scale = min(max(scale, self.__fitScale()), ZOOM_MAX_SCALE)
+        if scale != self.scale:
+            self.scale = scale
+            self.__clearTiles()
+
+    def __level(self) -> int:
+        level = 0
+        while level + 1 < self.image.levels and self.scale <= 0.5 ** (level + 1):
+            level += 1
+        return level
+
+    def __scheduleDraw(self) -> None:
+        if self.visible and self.image is not None and not self.draw_scheduled:
+            self.draw_scheduled = True
+            self.root.after_idle(self.__draw)
+
+    def __draw(self) -> None:
+        self.draw_scheduled = False
+        if not self.visible or self.image is None:
+            return
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        w, h = self.image.size
+        cx = min(
+            max(self.center[0], width / 2 / self.scale), w - width / 2 / self.scale
+        )
+        cy = min(
+            max(self.center[1], height / 2 / self.scale), h - height / 2 / self.scale
+        )
+        # Smaller than the window: center it.
+        self.center = (
+            cx if w * self.scale > width else w / 2,
+            cy if h * self.scale > height else h / 2,
+        )
+        left = self.center[0] - width / 2 / self.scale
+        top = self.center[1] - height / 2 / self.scale
+
+        self.__drawBackground(left, top, width, height)
+        level = self.__level()
+        span = TILE_SIZE * (1 << level)
+        columns, rows = (-(-v // TILE_SIZE) for v in self.image.level_size(level))
+        first_column, first_row = int(left // span), int(top // span)
+        last_column = int((left + width / self.scale - 1) // span)
+        last_row = int((top + height / self.scale - 1) // span)
+
+        visible = set()
+        for row in range(max(0, first_row), min(rows, last_row + 1)):
+            for column in range(max(0, first_column), min(columns, last_column + 1)):
+                key = self.image.key(level, column, row)
+                visible.add(key)
+                x = (column * span - left) * self.scale
+                y = (row * span - top) * self.scale
+                if key in self.items:
+                    self.canvas.coords(self.items[key][0], x, y)
+                    continue
+                tile = self.cache.get(key)
+                if tile is not None:
+                    size = (
+                        max(1, round(tile.width * span / TILE_SIZE * self.scale)),
+                        max(1, round(tile.height * span / TILE_SIZE * self.scale)),
+                    )
+                    photo = ImageTk.PhotoImage(tile.resize(size, Image.BILINEAR))
+                    item = self.canvas.create_image(
+                        x, y, anchor=tkinter.NW, image=photo
+                    )
+                    self.items[key] = (item, photo)
+        for key in [k for k in self.items if k not in visible]:
+            self.canvas.delete(self.items.pop(key)[0])
+
+        # Prefetch a margin of tiles in the direction of the last pan.
+        dx, dy = self.direction
+        wanted = []
+        for row in range(
+            max(0, first_row + min(dy, 0) * ZOOM_PREFETCH),
+            min(rows, last_row + 1 + max(dy, 0) * ZOOM_PREFETCH),
+        ):
+            for column in range(
+                max(0, first_column + min(dx, 0) * ZOOM_PREFETCH),
+                min(columns, last_column + 1 + max(dx, 0) * ZOOM_PREFETCH),
+            ):
+                wanted.append((level, column, row))
+        self.__request(wanted)
+
+    def __drawBackground(self, left, top, width, height) -> None:
+        """Stretch the coarsest tile over the visible part of the image."""
+        w, h = self.image.size
+        x0, y0 = max(left, 0), max(top, 0)
+        x1 = min(left + width / self.scale, w)
+        y1 = min(top + height / self.scale, h)
+        factor = w / self.background.width
+        size = (
+            max(1, round((x1 - x0) * self.scale)),
+            max(1, round((y1 - y0) * self.scale)),
+        )
+        box = (x0 / factor, y0 / factor, x1 / factor, y1 / factor)
+        self.background_photo = ImageTk.PhotoImage(
+            self.background.resize(size, Image.BILINEAR, box=box)
+        )
+        x, y = (x0 - left) * self.scale, (y0 - top) * self.scale
+        if self.background_item is None:
+            self.background_item = self.canvas.create_image(
+                x, y, anchor=tkinter.NW, image=self.background_photo
+            )
+            self.canvas.lower(self.background_item)
+        else:
+            self.canvas.coords(self.background_item, x, y)
+            self.canvas.itemconfig(self.background_item, image=self.background_photo)
+
+    def __request(self, wanted) -> None:
+        keys = {self.image.key(*tile): tile for tile in wanted}
+        for key in [k for k in self.pending if k not in keys]:
+            self.pending.pop(key).cancel()
+        for key, tile in keys.items():
+            if key not in self.pending and key not in self.cache:
+                self.pending[key] = self.pool.submit(self.image.load, *tile)
+        if self.pending and not self.polling:
+            self.polling = True
+            self.root.after(20, self.__poll)
+
+    def __poll(self) -> None:
+        self.polling = False
+        done = [key for key, future in self.pending.items() if future.done()]
+        for key in done:
+            future = self.pending.pop(key)
+            if not future.cancelled() and future.exception() is not None:
+                print("error loading tile:" + str(key))
+                print(future.exception())
+        if done:
+            self.__scheduleDraw()
+        elif self.pending and self.visible:
+            self.polling = True
+            self.root.after(20, self.__poll)
+
+    def __pan(self, dx, dy) -> None:
+        """Move the view by dx, dy window pixels."""
+        self.center = (
+            self.center[0] + dx / self.scale,
+            self.center[1] + dy / self.scale,
+        )
+        self.direction = ((dx > 0) - (dx < 0), (dy > 0) - (dy < 0))
+        self.__scheduleDraw()
+
+    def __panKeyCB(self, direction) -> str:
+        if self.image is not None:
+            self.__pan(
+                direction[0] * self.canvas.winfo_width() / 4,
+                direction[1] * self.canvas.winfo_height() / 4,
+            )
+        return "break"
+
+    def __zoomAt(self, factor, x, y) -> None:
+        """Zoom by factor, keeping the image point under window position x, y in place."""
+        if self.image is None:
+            return
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        px = self.center[0] + (x - width / 2) / self.scale
+        py = self.center[1] + (y - height / 2) / self.scale
+        self.__setScale(self.scale * factor)
+        self.center = (
+            px - (x - width / 2) / self.scale,
+            py - (y - height / 2) / self.scale,
+        )
+        self.direction = (0, 0)
+        self.__scheduleDraw()
+
+    def __zoomCB(self, factor) -> str:
+        self.__zoomAt(
+            factor, self.canvas.winfo_width() / 2, self.canvas.winfo_height() / 2
+        )
+        return "break"
+
+    def __wheelCB(self, event) -> str:
+        factor = ZOOM_STEP if event.num == 4 or event.delta > 0 else 1 / ZOOM_STEP
+        self.__zoomAt(factor, event.x, event.y)
+        return "break"
+
+    def __fitCB(self, _event=None) -> str:
+        if self.image is not None:
+            self.__setScale(0)
+            self.center = (self.image.size[0] / 2, self.image.size[1] / 2)
+            self.__scheduleDraw()
+        return "break"
+
+    def __dragStartCB(self, event) -> str:
+        self.canvas.focus_set()
+        self.drag = (event.x, event.y)
+        return "break"
+
+    def __dragCB(self, event) -> str:
+        if self.drag is not None and self.image is not None:
+            self.__pan(self.drag[0] - event.x, self.drag[1] - event.y)
+            self.drag = (event.x, event.y)
+        return "break"
+
+    def __closeCB(self, _event=None) -> str:
+        self.hide()
+        if self.on_close is not None:
+            self.on_close()
+        return "break"
+
+
+class App:
+    def __init__(
+        self,
+        r,
+        f,
+        db,
+        prefetcher,
+        video_pipelines=2,
+        thumbnail_size=192,
+        thumbnail_cache_bytes=64 * 1024 * 1024,
+        auto_add=False,
+        follow=False,
+        tile_cache_bytes=128 * 1024 * 1024,
+        autosave=0,
+    ):
+        self.root = r
+        self.filelist = f
+        self.db = db
+        self.writer = DatabaseWriter(db) if db else None
+        # Set when a background refresh changed a Sheets DB; polled below.
+        self.db_changed = getattr(db, "changed", None)
+        self.autosave = autosave
+        self.save_polling = False
+        self.save_status_serial = 0
+        self.prefetcher = prefetcher
+        self.auto_add = auto_add
+        self.follow = follow
+        self.videos = VideoPool(r, video_pipelines)
+        self.display_serial = 0
+
+        self.w, self.h = r.winfo_width(), r.winfo_height()
+        self.input_image = None
+        self.image = None
+        self.canvas_image = None
+        self.video_player = None
+        self.refinement = None
+
+        # Let's keep all class variables here in one place.
+        self.canvas = tkinter.Canvas(
+            self.root,
+            width=self.w,
+            height=self.h,
+            highlightthickness=0,
+            background="black",
+        )
+        self.canvas_visible = True
+        self.filename_label = tkinter.Label(
+            self.root, font=("Arial", self.w // 80), bg="gray"
+        )
+        self.filename_visible = False
+        self.metadataFrame = tkinter.Frame(self.root, bg="black")
+        self.video_frame = None
+        self.rating = tkinter.Label(
+            self.metadataFrame,
+            font=("Arial", self.w // 80),
+            bg="black",
+            fg="yellow",
+            anchor=tkinter.E,
+        )
+        # One label for all keywords, so redrawing costs the same for any tag count.
+        self.keywordOutput = tkinter.Label(
+            self.metadataFrame,
+            font=("Arial", self.w // 80),
+            bg="black",
+            fg="white",
+            anchor=tkinter.E,
+            justify=tkinter.RIGHT,
+        )
+
+        self.keywordText = tkinter.StringVar()
+        self.keywordEntry = tkinter.Entry(
+            self.root,
+            font=("Arial", self.w // 80),
+            bg="black",
+            fg="white",
+            insertbackground="white",
+            textvariable=self.keywordText,
+        )
+        self.keywordSuggestions = tkinter.Label(
+            self.root,
+            font=("Arial", self.w // 100),
+            bg="black",
+            fg="gray",
+            anchor=tkinter.W,
+        )
+        self.saveStatus = tkinter.Label(
+            self.root,
+            font=("Arial", self.w // 100),
+            bg="black",
+            fg="gray",
+            anchor=tkinter.W,
+        )
+
+        self.grid = GridView(
+            self.root,
+            self.filelist,
+            self.db,
+            thumbnail_size,
+            thumbnail_cache_bytes,
+            render_cache=prefetcher.render_cache,
+            on_close=self.__gridClosed,
+        )
+        self.zoom = ZoomView(self.root, tile_cache_bytes)
+
+        self.__createWidgets()
+        self.__bindRootEvents()
+        self.__updateDisplay()
+        if self.filelist.changes is not None or self.db_changed is not None:
+            self.root.after(WATCH_UI_INTERVAL, self.__pollChangesCB)
+        if self.writer is not None and self.autosave > 0:
+            self.root.after(self.autosave * 1000, self.__autosaveCB)
+
+        self.keywordDictionary = KeywordDictionary(
+            db.keyword_counts() if self.db else None
+        )
+        self.detect_pressed_filled = False
+
+    def __bindRootEvents(self) -> None:
+        self.root.bind("<Escape>", self.__exitCB)
+        self.root.bind("<Right>", self.__nextCB)
+        self.root.bind("<Left>", self.__prevCB)
+        self.root.bind("<p>", self.__togglePlayCB)
+        self.root.bind("<r>", self.__restartCB)
+        self.root.bind("<t>", self.__toggleFilenameCB)
+        self.root.bind("<g>", self.__showGridCB)
+        self.root.bind("<z>", self.__zoomCB)
+        self.root.bind("<Configure>", self.__configureCB)
+        if self.db:
+            self.root.bind("<s>", self.__saveDBCB)
+            self.root.bind("0", self.__setRatingCB)
+            self.root.bind("1", self.__setRatingCB)
+            self.root.bind("2", self.__setRatingCB)
+            self.root.bind("3", self.__setRatingCB)
+            self.root.bind("4", self.__setRatingCB)
+            self.root.bind("5", self.__setRatingCB)
+            self.root.bind("6", self.__setRatingCB)
+            self.root.bind("7", self.__setRatingCB)
+            self.root.bind("8", self.__setRatingCB)
+            self.root.bind("9", self.__setRatingCB)
+            self.root.bind("-", self.__setRatingCB)
+            self.root.bind("+", self.__setRatingCB)
+            self.root.bind("#", self.__showKeywordEntryCB)
+            self.root.bind("!", self.__showKeywordEntryCB)
+            self.root.bind("@", self.__showKeywordEntryCB)
+
+    def __createWidgets(self) -> None:
+
+        self.canvas.place(relx=0, rely=0, anchor=tkinter.NW, relwidth=1, relheight=1)
+        self.metadataFrame.place(relx=1, rely=0, anchor=tkinter.NE)
+
+        if self.db:
+            self.rating.pack(fill="x")
+            self.keywordOutput.pack(fill="x")
+
+        self.keywordEntry.bind("<Return>", self.__keywordEntryAcceptCB)
+        self.keywordEntry.bind("<Escape>", self.__keywordEntryCancelCB)
+        self.keywordEntry.bind("<KeyRelease>", self.__keywordEntryKeyreleaseCB)
+        self.keywordEntry.bind("<Key>", self.__keywordEntryKeypressCB)
+        self.keywordEntry.bind("<Tab>", self.__keywordEntryCompleteCB)
+
+    def __setVideo(self, filename) -> None:
+        poster = self.prefetcher.poster(filename, self.w, self.h)
+        if poster is not None:
+            self.image = ImageTk.PhotoImage(poster)
+            self.__showImage()
+        pipeline = self.videos.play(Path(filename).absolute().as_uri())
+        self.video_player = pipeline.player
+        if poster is None:
+            self.__setvideoframe(pipeline.frame)
+        else:
+            # Keep the poster up until the pipeline has a frame to show.
+            self.__waitForVideo(pipeline, self.display_serial, time.monotonic())
+
+    def __waitForVideo(self, pipeline, serial, started) -> None:
+        if serial != self.display_serial or pipeline is not self.videos.current:
+            return
+        (_ret, state, _pending) = pipeline.player.get_state(timeout=0)
+        if state == gst().State.PLAYING or time.monotonic() - started > 5:
+            self.__setvideoframe(pipeline.frame)
+        else:
+            self.root.after(
+                20, self.__waitForVideo, pipeline, serial, started
+            )
+
+    def __setvideoframe(self, frame):
+        if frame is not self.video_frame:
+            frame.place(relx=0, rely=0, anchor=tkinter.NW, relwidth=1, relheight=1)
+            # Keep the rating/keyword overlays above the video.
+            frame.lower()
+            if self.video_frame is not None and self.video_frame.winfo_exists():
+                self.video_frame.place_forget()
+            self.video_frame = frame
+        if self.canvas_visible:
+            self.canvas.place_forget()
+            self.canvas_visible = False
+
+    def __prerollNextVideo(self) -> None:
+        for path in self.filelist.neighbors(VIDEO_PREROLL_SEARCH, 0):
+            if FileType.getType(path.suffix) == FileType.VIDEO:
+                self.videos.preroll(path.absolute().as_uri())
+                return
+
+    def __setImage(self, filename) -> None:
+        try:
+            kind = Path(filename).suffix.lower()
+            with PROFILER.span("load", kind):
+                scaled_image, source = self.prefetcher.preview(
+                    filename, self.w, self.h
+                )
+            with PROFILER.span("photoimage", kind):
+                self.image = ImageTk.PhotoImage(scaled_image)
+            if source is not None:
+                self.root.after_idle(
+                    self.__refineImage, filename, source, self.display_serial
+                )
+        except Exception as e:
+            print("error loading image:" + filename)
+            print(e)
+
+    def __refineImage(self, filename, source, serial) -> None:
+        # Skipped when the user has moved on before Tk became idle.
+        if serial != self.display_serial:
+            return
+        self.refinement = self.prefetcher.refine(filename, source, self.w, self.h)
+        self.__showRefinedImage(self.refinement, serial)
+
+    def __showRefinedImage(self, future, serial) -> None:
+        if serial != self.display_serial or future is not self.refinement:
+            return
+        if not future.done():
+            self.root.after(10, self.__showRefinedImage, future, serial)
+            return
+        self.refinement = None
+        try:
+            self.image = ImageTk.PhotoImage(future.result())
+        except Exception as e:
+            print("error refining image")
+            print(e)
+            return
+        if self.canvas_image is not None:
+            self.canvas.itemconfig(self.canvas_image, image=self.image)
+
+    def __showImage(self) -> None:
+        if not self.canvas_visible:
+            self.videos.pause()
+            self.canvas.place(
+                relx=0, rely=0, anchor=tkinter.NW, relwidth=1, relheight=1
+            )
+            self.canvas.lower()
+            if self.video_frame.winfo_exists():
+                self.video_frame.place_forget()
+            self.video_frame = None
+            self.canvas_visible = True
+        if self.canvas_image is None:
+            self.canvas_image = self.canvas.create_image(
+                self.w / 2, self.h / 2, image=self.image
+            )
+        else:
+            self.canvas.itemconfig(self.canvas_image, image=self.image)
+        if PROFILER.enabled:
+            # Tk paints when idle; force it so the paint is measured.
+            with PROFILER.span("paint"):
+                self.root.update_idletasks()
+
+    def __updateDisplay(self, event="display") -> None:
+        path = self.filelist.current()
+        filename = str(path.name)
+        self.display_serial += 1
+        if self.refinement is not None:
+            self.refinement.cancel()
+            self.refinement = None
+        PROFILER.begin_event(event, path)
+        self.filename_label["text"] = filename
+        if not self.root.attributes("-fullscreen"):
+            self.root.title(filename)
+
+        if self.db:
+            self.__updateMetadata(filename)
+
+        if self.filelist.currentType() == FileType.IMAGE:
+            self.__setImage(str(path))
+            self.__showImage()
+        elif self.filelist.currentType() == FileType.VIDEO:
+            self.__setVideo(str(path))
+        if self.videos.current is not None:
+            # Not before the first video, so GStreamer is not loaded at startup.
+            self.prefetcher.extract_posters(self.filelist, self.w, self.h)
+        self.prefetcher.schedule(self.filelist, self.w, self.h)
+        self.__prerollNextVideo()
+        PROFILER.end_event()
+
+    def __configureCB(self, event=None) -> None:
+        if not self.__is_relevant_event(event):
+            return
+        if (event.width, event.height) == (self.w, self.h):
+            return
+        self.w, self.h = event.width, event.height
+        self.prefetcher.resize(self.w, self.h)
+        if self.canvas_image is not None:
+            self.canvas.coords(self.canvas_image, self.w / 2, self.h / 2)
+        if self.filelist.currentType() == FileType.IMAGE:
+            self.__updateDisplay()
+
+    def __updateMetadata(self, filename) -> None:
+        row = self.db.row(filename)
+        if row is not None:
+            rating, keywords = row
+            numstars = self.__get_stars(rating)
+            self.__setKeywordOutput(keywords)
+            print("Filename: " + filename)
+            print("Stars: " + str(numstars))
+            print("Keywords: " + keywords)
+        else:
+            self.rating["text"] = star[1]
+            self.__setKeywordOutput("")
+
+    def __dbChanged(self) -> None:
+        self.keywordDictionary = KeywordDictionary(self.db.keyword_counts())
+        self.__updateMetadata(self.filelist.current().name)
+        if self.grid.visible:
+            self.grid.refresh()
+
+    def __get_stars(self, rating):
+        numstars = int(rating)
+        if (numstars >= -1) and (numstars <= 10):
+            self.rating["text"] = star[numstars + 1]
+        return numstars
+
+    def __toggleFilenameCB(self, event=None) -> None:
+        if self.__is_relevant_event(event):
+            if self.filename_visible:
+                self.filename_label.place_forget()
+                self.filename_visible = False
+            else:
+                self.filename_label.place(relx=0.5, rely=0, anchor=tkinter.N)
+                self.filename_visible = True
+
+    def __togglePlayCB(self, event=None) -> None:
+        if (
+            self.__is_relevant_event(event)
+            and self.filelist.currentType() == FileType.VIDEO
+        ):
+            Gst = gst()
+            (_ret, temp_state, _p_state) = self.video_player.get_state(
+                timeout=Gst.SECOND
+            )
+            if temp_state == Gst.State.PLAYING:
+                self.video_player.set_state(Gst.State.PAUSED)
+            elif temp_state == Gst.State.PAUSED:
+                self.video_player.set_state(Gst.State.PLAYING)
+
+    def __is_relevant_event(self, event):
+        return event.widget == self.root
+
+    def __is_edit_event(self, event):
+        """Rating, keyword and save keys also apply to the files selected in the grid."""
+        return self.__is_relevant_event(event) or self.grid.owns(event)
+
+    def __targets(self) -> list:
+        if self.grid.visible:
+            return self.grid.targets()
+        return [str(self.filelist.current().name)]
+
+    def __showGridCB(self, event=None) -> None:
+        if self.__is_relevant_event(event):
+            self.videos.pause()
+            self.grid.show()
+            self.prefetcher.extract_posters(self.filelist, self.w, self.h)
+
+    def __zoomCB(self, event=None) -> None:
+        if (
+            self.__is_relevant_event(event)
+            and self.filelist.currentType() == FileType.IMAGE
+        ):
+            self.zoom.show(str(self.filelist.current()))
+
+    def __gridClosed(self) -> None:
+        self.__updateDisplay("grid")
+
+    def __pollChangesCB(self) -> None:
+        if self.db_changed is not None and self.db_changed.is_set():
+            self.db_changed.clear()
+            self.__dbChanged()
+        current = self.filelist.current()
+        added = []
+        changed = modified = False
+        while self.filelist.changes is not None:
+            try:
+                kind, path = self.filelist.changes.get_nowait()
+            except queue.Empty:
+                break
+            changed = True
+            if kind == "add":
+                added.append(path)
+            elif kind == "remove" and path in added:
+                added.remove(path)
+            elif kind == "modify":
+                self.prefetcher.cache.retain(lambda key: key[0] != str(path))
+                modified = modified or path == current
+        if added and self.auto_add and self.db is not None:
+            self.db.add_files(stat_files(added))
+        # Not while a keyword is being typed for the file on screen.
+        if (
+            added
+            and self.follow
+            and not self.grid.visible
+            and not self.keywordEntry.winfo_ismapped()
+        ):
+            self.filelist.seek_path(added[-1])
+        if self.grid.visible:
+            if changed:
+                self.grid.refresh()
+        elif modified or self.filelist.current() != current:
+            self.__updateDisplay("watch")
+        elif changed:
+            self.prefetcher.schedule(self.filelist, self.w, self.h)
+        self.root.after(WATCH_UI_INTERVAL, self.__pollChangesCB)
+
+    def __restartCB(self, event=None) -> None:
+        if (
+            self.__is_relevant_event(event)
+            and self.filelist.currentType() == FileType.VIDEO
+        ):
+            Gst = gst()
+            self.video_player.set_state(Gst.State.NULL)
+            self.video_player.set_state(Gst.State.PLAYING)
+
+    def __nextCB(self, event=None) -> None:
+        if self.__is_relevant_event(event):
+            self.filelist.next_file()
+            self.__updateDisplay("next")
+
+    def __prevCB(self, event=None) -> None:
+        if self.__is_relevant_event(event):
+            self.filelist.prev_file()
+            self.__updateDisplay("prev")
+
+    def __exitCB(self, event=None) -> None:
+        if self.__is_relevant_event(event):
+            self.prefetcher.shutdown()
+            self.grid.shutdown()
+            self.zoom.shutdown()
+            self.videos.release()
+            event.widget.withdraw()
+            if self.writer is not None:
+                if self.autosave > 0 and self.db.unsaved:
+                    self.writer.request()
+                # Do not cut off a save that is being written.
+                self.writer.shutdown()
+            event.widget.quit()
+
+    def __showKeywordEntryCB(self, event=None) -> None:
+        if self.__is_edit_event(event):
+            self.keywordText.set(event.char)
+            self.keywordEntry.place(
+                relx=0.5, rely=0.5, anchor=tkinter.CENTER, relwidth=0.5
+            )
+            self.keywordEntry.lift()
+            self.keywordEntry.icursor("end")
+            self.keywordEntry.focus_set()
+
+    def __hideKeywordEntry(self) -> None:
+        self.keywordEntry.place_forget()
+        self.keywordSuggestions.place_forget()
+        if self.grid.visible:
+            self.grid.canvas.focus_set()
+        else:
+            self.root.focus_set()
+
+    def __setKeywordOutput(self, val) -> None:
+        self.keywordOutput["text"] = "\n".join(val.split())
+
+    def __saveDBCB(self, event=None) -> None:
+        if self.__is_edit_event(event):
+            self.__requestSave()
+
+    def __requestSave(self) -> None:
+        self.writer.request()
+        if not self.save_polling:
+            self.save_polling = True
+            self.root.after(SAVE_POLL_INTERVAL, self.__pollSaveCB)
+
+    def __pollSaveCB(self) -> None:
+        message = None
+        while not self.writer.messages.empty():
+            message = self.writer.messages.get()
+        if message is not None:
+            text, failed = message
+            self.saveStatus.configure(text=text, fg="red" if failed else "gray")
+            self.saveStatus.place(relx=0, rely=1, anchor=tkinter.SW)
+            self.saveStatus.lift()
+            self.save_status_serial += 1
+            if not failed and not self.writer.busy:
+                self.root.after(
+                    SAVE_STATUS_SECONDS * 1000,
+                    self.__hideSaveStatus,
+                    self.save_status_serial,
+                )
+        if self.writer.busy or not self.writer.messages.empty():
+            self.root.after(SAVE_POLL_INTERVAL, self.__pollSaveCB)
+        else:
+            self.save_polling = False
+
+    def __hideSaveStatus(self, serial) -> None:
+        # A newer message, e.g. a failure, stays up.
+        if serial == self.save_status_serial:
+            self.saveStatus.place_forget()
+
+    def __autosaveCB(self) -> None:
+        if self.db.unsaved and not self.writer.busy:
+            self.__requestSave()
+        self.root.after(self.autosave * 1000, self.__autosaveCB)
+
+    def __setRatingCB(self, event=None) -> None:
+        if self.__is_edit_event(event):
+            value = ratingvalue[event.char]
+            self.__setColumn(
+                "rating",
+                {f: value for f in self.__targets() if f in self.db},
+            )
+
+            if self.grid.visible:
+                self.grid.refresh()
+            else:
+                self.__updateMetadata(str(self.filelist.current().name))
+
+    def __matchString(self):
+        got = self.keywordText.get()
+        return self.keywordDictionary.matches(got, limit=KEYWORD_SUGGESTIONS)
+
+    def __showHit(self, lst) -> None:
+        if len(lst) == 1:
+            self.keywordText.set(lst[0])
+            self.detect_pressed_filled = True
+        if len(lst) > 1:
+            self.keywordSuggestions["text"] = "  ".join(lst)
+            self.keywordSuggestions.place(
+                in_=self.keywordEntry, relx=0, rely=1, anchor=tkinter.NW, relwidth=1
+            )
+            self.keywordSuggestions.lift()
+        else:
+            self.keywordSuggestions.place_forget()
+
+    def __keywordEntryKeyreleaseCB(self, event) -> None:
+        if len(event.keysym) == 1:
+            hits = self.__matchString()
+            self.__showHit(hits)
+
+    def __keywordEntryCompleteCB(self, _event) -> str:
+        hits = self.__matchString()
+        if hits:
+            self.keywordText.set(hits[0])
+            self.keywordEntry.icursor("end")
+            self.keywordSuggestions.place_forget()
+        return "break"
+
+    def __keywordEntryKeypressCB(self, event) -> None:
+        key = event.char
+        if len(key) == 1 and self.detect_pressed_filled is True:
+            pos = self.keywordEntry.index(tkinter.INSERT)
+            self.keywordEntry.delete(pos, tkinter.END)
+
+    def __toggleKeyword(self, filenames, keyword) -> None:
+        """Add keyword to the files that lack it, or remove it if all of them have it."""
+        filenames = [filename for filename in filenames if filename in self.db]
+        add = not all(keyword in self.db.keywords(f).split() for f in filenames)
+        changed = {}
+        for filename in filenames:
+            curKeywords = self.db.keywords(filename).strip().split()
+            if add and keyword not in curKeywords:
+                curKeywords.append(keyword)
+                self.keywordDictionary.add(keyword, 1)
+            elif not add and keyword in curKeywords:
+                curKeywords.remove(keyword)
+                self.keywordDictionary.add(keyword, -1)
+            else:
+                continue
+            changed[filename] = " ".join(curKeywords)
+        self.__setColumn("keywords", changed)
+
+    def __setColumn(self, column, values) -> None:
+        """Write {filename: value} to the DB, several files in one update_files call.
+
+        That is a single transaction or journal flush instead of one per file.
+        """
+        if len(values) == 1:
+            ((filename, value),) = values.items()
+            if column == "rating":
+                self.db.set_rating(filename, value)
+            else:
+                self.db.set_keywords(filename, value)
+        elif values:
+            import pandas as pd
+
+            self.db.update_files(
+                pd.DataFrame(
+                    {column: list(values.values())},
+                    index=pd.Index(list(values), name="filename"),
+                )
+            )
+
+    def __keywordEntryAcceptCB(self, _event) -> None:
+        filenames = self.__targets()
+        keywords = re.findall(
+            r"[!#@].+?(?=[!#@]|$)", "".join(self.keywordText.get().split())
+        )
+
+        for keyword in keywords:
+            self.__toggleKeyword(filenames, normalize_keyword(keyword))
+
+        #    print(df.at[f.current(),'keywords'])
+        if self.grid.visible:
+            self.grid.refresh()
+        else:
+            filename = str(self.filelist.current().name)
+            if filename in self.db:
+                self.__setKeywordOutput(self.db.keywords(filename))
+        self.__hideKeywordEntry()
+
+    def __keywordEntryCancelCB(self, _event) -> None:
+        self.__hideKeywordEntry()
+
+
+class SortedList:
+    """Sorted sequence stored as a list of bounded buckets.
+
+    Searches bisect the bucket maxima and then a single bucket, so lookups are
+    O(log n) and an insertion only shifts the items of one bucket. Positional
+    offsets are rebuilt lazily, which keeps bulk insertion cheap.
+    """
+
+    BUCKET_SIZE = 1000
+
+    def __init__(self, iterable=(), key=None):
+        self.key = key if key is not None else (lambda item: item)
+        self.buckets = []
+        self.bucket_keys = []
+        self.maxes = []
+        self.offsets = None
+        self.length = 0
+        items = sorted(iterable, key=self.key)
+        for start in range(0, len(items), self.BUCKET_SIZE):
+            bucket = items[start : start + self.BUCKET_SIZE]
+            self.buckets.append(bucket)
+            self.bucket_keys.append([self.key(item) for item in bucket])
+            self.maxes.append(self.bucket_keys[-1][-1])
+        self.length = len(items)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        for bucket in self.buckets:
+            yield from bucket
+
+    def __find(self, item):
+        k = self.key(item)
+        b = bisect.bisect_left(self.maxes, k)
+        if b == len(self.maxes):
+            return None
+        keys = self.bucket_keys[b]
+        i = bisect.bisect_left(keys, k)
+        while i < len(keys) and keys[i] == k:
+            if self.buckets[b][i] == item:
+                return b, i
+            i += 1
+        return None
+
+    def __contains__(self, item) -> bool:
+        return self.__find(item) is not None
+
+    def __offsets(self) -> list:
+        if self.offsets is None:
+            self.offsets = [0]
+            for bucket in self.buckets:
+                self.offsets.append(self.offsets[-1] + len(bucket))
+        return self.offsets
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("SortedList index out of range")
+        offsets = self.__offsets()
+        b = bisect.bisect_right(offsets, index) - 1
+        return self.buckets[b][index - offsets[b]]
+
+    def index(self, item) -> int:
+        found = self.__find(item)
+        if found is None:
+            raise ValueError("%r is not in list" % (item,))
+        b, i = found
+        return self.__offsets()[b] + i
+
+    def bisect_left(self, k) -> int:
+        b = bisect.bisect_left(self.maxes, k)
+        if b == len(self.maxes):
+            return self.length
+        return self.__offsets()[b] + bisect.bisect_left(self.bucket_keys[b], k)
+
+    def add(self, item) -> None:
+        k = self.key(item)
+        self.offsets = None
+        self.length += 1
+        if not self.buckets:
+            self.buckets.append([item])
+            self.bucket_keys.append([k])
+            self.maxes.append(k)
+            return
+        b = min(bisect.bisect_left(self.maxes, k), len(self.maxes) - 1)
+        bucket, keys = self.buckets[b], self.bucket_keys[b]
+        i = bisect.bisect_right(keys, k)
+        bucket.insert(i, item)
+        keys.insert(i, k)
+        self.maxes[b] = keys[-1]
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            half = len(bucket) // 2
+            self.buckets[b : b + 1] = [bucket[:half], bucket[half:]]
+            self.bucket_keys[b : b + 1] = [keys[:half], keys[half:]]
+            self.maxes[b : b + 1] = [keys[half - 1], keys[-1]]
+
+    def remove(self, item) -> None:
+        found = self.__find(item)
+        if found is None:
+            raise ValueError("%r is not in list" % (item,))
+        b, i = found
+        self.offsets = None
+        self.length -= 1
+        del self.buckets[b][i]
+        del self.bucket_keys[b][i]
+        if self.buckets[b]:
+            self.maxes[b] = self.bucket_keys[b][-1]
+        else:
+            del self.buckets[b], self.bucket_keys[b], self.maxes[b]
+
+
+class SortOrder:
+    """FileList keys for --sort date and --sort rating.
+
+    "date" orders by EXIF/container capture time, falling back to the file's
+    mtime; "rating" puts the best rated files first. Ties are broken by path.
+    A key is computed once per path and then kept, because the SortedList
+    finds entries again by their key: rating a file does not move it.
+    """
+
+    def __init__(self, order, metadata=None, photoDB=None):
+        self.order = order
+        self.metadata = metadata
+        self.photoDB = photoDB
+        self.keys = {}
+
+    def prepare(self, paths) -> None:
+        """Compute the keys of a batch of paths, reading their headers in parallel."""
+        paths = [path for path in paths if path not in self.keys]
+        if self.order == "date" and paths:
+            for path, metadata in zip(paths, self.metadata.get_many(paths)):
+                self.keys[path] = self.__date_key(path, metadata)
+
+    @staticmethod
+    def __date_key(path, metadata) -> tuple:
+        taken = metadata.taken if metadata is not None else None
+        if taken is None:
+            try:
+                taken = path.stat().st_mtime
+            except OSError:
+                taken = 0.0
+        return (taken, path.parts)
+
+    def __call__(self, path) -> tuple:
+        key = self.keys.get(path)
+        if key is None:
+            if self.order == "date":
+                key = self.__date_key(path, self.metadata.get(path))
+            else:
+                row = self.photoDB.row(path.name)
+                key = (-(row[0] if row is not None else 0), path.parts)
+            self.keys[path] = key
+        return key
+
+
+def scan_tree(root, recursive):
+    """Yield, in batches, the paths of the files under root that have an extension.
+
+    Directories are visited in sorted order and a directory's files are split
+    around its subdirectories, so the paths come out sorted like
+    sorted(root.rglob("*.*")) and the first batch holds the first file.
+    """
+    pending = [str(root)]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, list):
+            yield item
+            continue
+        try:
+            with os.scandir(item) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            print(e)
+            continue
+        batches = [[]]
+        for entry in entries:
+            # Like rglob, not into symlinked directories, which can loop.
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    batches += [entry.path, []]
+            elif "." in entry.name:
+                batches[-1].append(Path(entry.path))
+        pending.extend(reversed([batch for batch in batches if batch]))
+
+
+class DirectoryWatcher:
+    """Reports files that appear, change or disappear under a directory.
+
+    callback(kind, path, new_path=None) is called on a background thread with
+    kind "add" (also for a file that was rewritten), "remove", "rename",
+    "remove_tree" for a directory, or "sync" with the set of all files when
+    events may have been missed. inotify is used through ctypes where the C
+    library has it; otherwise the tree is rescanned every poll_interval
+    seconds and reported as "sync".
+    """
+
+    HEADER = struct.Struct("iIII")
+
+    def __init__(self, root, recursive, callback, poll_interval=WATCH_POLL_SECONDS):
+        self.root = Path(root)
+        self.recursive = recursive
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.watches = {}
+        self.fd = self.__inotify_init()
+        if self.fd is None:
+            target = self.__poll
+        else:
+            # Catches whatever changed between the scan and the watches.
+            self.callback("sync", self.__watch_tree(self.root))
+            target = self.__read
+        threading.Thread(target=target, daemon=True).start()
+
+    def __inotify_init(self):
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            print("inotify not available, polling for changes")
+            return None
+        if fd < 0:
+            print("inotify failed (%s), polling for changes" % os.strerror(ctypes.get_errno()))
+            return None
+        return fd
+
+    def __watch_tree(self, directory) -> set:
+        """Watch directory (and its subdirectories) and return the files in it."""
+        found = set()
+        directories = [str(directory)]
+        while directories:
+            current = directories.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(current), WATCH_MASK)
+            if wd < 0:
+                # ENOSPC here means fs.inotify.max_user_watches is too low.
+                print("cannot watch %s: %s" % (current, os.strerror(ctypes.get_errno())))
+                continue
+            self.watches[wd] = Path(current)
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        # As in scan_tree: symlinked directories can loop.
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive:
+                                directories.append(entry.path)
+                        elif "." in entry.name:
+                            found.add(Path(entry.path))
+            except OSError as e:
+                print(e)
+        return found
+
+    def __arrived(self, directory) -> None:
+        if self.recursive:
+            # Files may have been written before the watch existed.
+            for path in sorted(self.__watch_tree(directory)):
+                self.callback("add", path)
+
+    def __unwatch_tree(self, directory) -> None:
+        for wd, path in list(self.watches.items()):
+            if path == directory or directory in path.parents:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def __read(self) -> None:
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                print(e)
+                return
+            moved = {}
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.HEADER.unpack_from(data, offset)
+                offset += self.HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                try:
+                    self.__event(wd, mask, cookie, name, moved)
+                except Exception as e:
+                    print("error handling file event:" + name)
+                    print(e)
+            # A move without a matching arrival left the watched tree.
+            for path, is_dir in moved.values():
+                self.__gone(path, is_dir)
+
+    def __event(self, wd, mask, cookie, name, moved) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self.callback("sync", self.__scan())
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        path = directory / name
+        is_dir = bool(mask & IN_ISDIR)
+        if mask & IN_MOVED_FROM:
+            moved[cookie] = (path, is_dir)
+        elif mask & IN_MOVED_TO:
+            old = moved.pop(cookie, None)
+            if old is not None and not is_dir:
+                self.callback("rename", old[0], path)
+                return
+            if old is not None:
+                self.__gone(*old)
+            if is_dir:
+                self.__arrived(path)
+            else:
+                self.callback("add", path)
+        elif mask & IN_DELETE:
+            self.__gone(path, is_dir)
+        elif mask & IN_CREATE:
+            if is_dir:
+                self.__arrived(path)
+        elif mask & IN_CLOSE_WRITE:
+            self.callback("add", path)
+
+    def __gone(self, path, is_dir) -> None:
+        if is_dir:
+            self.__unwatch_tree(path)
+            self.callback("remove_tree", path)
+        else:
+            self.callback("remove", path)
+
+    def __scan(self) -> set:
+        return {path for found in scan_tree(self.root, self.recursive) for path in found}
+
+    def __poll(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            self.callback("sync", self.__scan())
+
+
+class FileList:
+    """Sorted list of media files with a cursor.
+
+    Without explicit files the tree is scanned with os.scandir on a background
+    thread: the constructor returns as soon as the first file (or the --first
+    file) is known and the list keeps growing while the App is running. The
+    cursor stays on the same file as entries are inserted around it.
+
+    watch() keeps the list in step with the scanned tree afterwards and
+    queues each change as ("add" | "remove" | "modify", path) on `changes`.
+    """
+
+    def __init__(
+        self, recursive=False, first=None, input_filelist=None, accept=None, order=None
+    ):
+        self.accept = accept
+        self.order = order
+        if order is not None:
+            self.sort_key = order
+        self.lock = threading.Condition()
+        self.file_index = 0
+        self.current_path = None
+        self.complete = False
+        self.filelist = SortedList(key=self.sort_key)
+        self.root = None
+        self.recursive = recursive
+        self.changes = None
+        self.watcher = None
+
+        first_path = Path(first).absolute() if first is not None else None
+        if input_filelist:
+            self.__add(Path(file).absolute() for file in input_filelist)
+            self.complete = True
+            if self.length > 0:
+                self.__seek(0)
+        else:
+            root = self.root = Path.cwd()
+            if (
+                first_path is not None
+                and first_path.is_file()
+                and (
+                    first_path.parent == root
+                    or (recursive and root in first_path.parents)
+                )
+            ):
+                self.__add([first_path])
+            threading.Thread(
+                target=self.__scan, args=(root, recursive), daemon=True
+            ).start()
+
+        with self.lock:
+            if first_path is not None and first_path not in self.filelist:
+                self.lock.wait_for(lambda: self.complete)
+            else:
+                self.lock.wait_for(lambda: self.length > 0 or self.complete)
+            if first_path is not None and self.length > 0:
+                index = self.filelist.bisect_left(self.sort_key(first_path))
+                self.__seek(min(index, self.length - 1))
+
+    @staticmethod
+    def sort_key(path):
+        return path.parts
+
+    @property
+    def length(self) -> int:
+        return len(self.filelist)
+
+    def __add(self, paths) -> list:
+        paths = [
+            path
+            for path in paths
+            if FileType.getType(path.suffix) != FileType.UNKNOWN
+            and (self.accept is None or self.accept(path))
+        ]
+        if self.order is not None:
+            # Read what the keys need, e.g. capture times, outside the lock.
+            self.order.prepare(paths)
+        # In order, so the first file of the first batch is where a list
+        # without --first starts.
+        paths.sort(key=self.sort_key)
+        added = []
+        with self.lock:
+            for path in paths:
+                if path in self.filelist:
+                    continue
+                if self.current_path is None:
+                    self.current_path = path
+                elif self.sort_key(path) < self.sort_key(self.current_path):
+                    self.file_index += 1
+                self.filelist.add(path)
+                added.append(path)
+            self.lock.notify_all()
+        return added
+
+    def __remove(self, path) -> bool:
+        with self.lock:
+            if path not in self.filelist:
+                return False
+            if self.sort_key(path) < self.sort_key(self.current_path):
+                self.file_index -= 1
+            self.filelist.remove(path)
+            # The cursor moves to the next file; an emptied list keeps the
+            # last path so there is still something to show.
+            if path == self.current_path and self.length > 0:
+                self.__seek(min(self.file_index, self.length - 1))
+            return True
+
+    def __scan(self, root, recursive) -> None:
+        try:
+            for found in scan_tree(root, recursive):
+                self.__add(found)
+        finally:
+            with self.lock:
+                self.complete = True
+                self.lock.notify_all()
+
+    def wait(self) -> None:
+        """Block until the background scan has found every file."""
+        with self.lock:
+            self.lock.wait_for(lambda: self.complete)
+
+    def watch(self) -> None:
+        """Follow files being added, changed, renamed and removed under the scanned root."""
+        self.changes = queue.SimpleQueue()
+        threading.Thread(target=self.__start_watcher, daemon=True).start()
+
+    def __start_watcher(self) -> None:
+        self.wait()
+        self.watcher = DirectoryWatcher(self.root, self.recursive, self.__changed)
+
+    def __changed(self, kind, path, new_path=None) -> None:
+        # The lock is only taken for lookups and inside __add and __remove,
+        # so sort keys and the sync diff are computed without it.
+        if kind == "add":
+            with self.lock:
+                modified = path in self.filelist
+            if modified:
+                self.changes.put(("modify", path))
+            else:
+                self.__added(self.__add([path]))
+        elif kind == "remove":
+            self.__removed([path])
+        elif kind == "rename":
+            was_current = path == self.current_path
+            self.__removed([path])
+            if self.__added(self.__add([new_path])) and was_current:
+                self.seek_path(new_path)
+        elif kind == "remove_tree":
+            inside = lambda entry: entry.parts[: len(path.parts)] == path.parts
+            if self.order is None:
+                # Entries sort by path parts, so a directory's files are contiguous.
+                with self.lock:
+                    start = self.filelist.bisect_left(path.parts)
+                    doomed = []
+                    for entry in self.entries(start, self.length):
+                        if not inside(entry):
+                            break
+                        doomed.append(entry)
+            else:
+                with self.lock:
+                    entries = list(self.filelist)
+                doomed = [entry for entry in entries if inside(entry)]
+            self.__removed(doomed)
+        elif kind == "sync":
+            with self.lock:
+                entries = list(self.filelist)
+            known = set(entries)
+            self.__removed([entry for entry in entries if entry not in path])
+            self.__added(self.__add(entry for entry in path if entry not in known))
+
+    def __added(self, paths) -> list:
+        for path in paths:
+            self.changes.put(("add", path))
+        return paths
+
+    def __removed(self, paths) -> None:
+        for path in paths:
+            if self.__remove(path):
+                self.changes.put(("remove", path))
+
+    def __seek(self, index) -> Path:
+        self.file_index = index
+        self.current_path = self.filelist[index]
+        return self.current_path
+
+    def seek(self, index) -> Path:
+        with self.lock:
+            if self.length == 0:
+                return self.current_path
+            return self.__seek(index % self.length)
+
+    def seek_path(self, path) -> bool:
+        with self.lock:
+            if path not in self.filelist:
+                return False
+            self.__seek(self.filelist.index(path))
+            return True
+
+    def next_file(self) -> Path:
+        with self.lock:
+            return self.seek(self.file_index + 1)
+
+    def prev_file(self) -> Path:
+        with self.lock:
+            return self.seek(self.file_index - 1)
+
+    def current(self) -> Path:
+        return self.current_path
+
+    def neighbors(self, ahead, behind) -> list:
+        """Paths of the next `ahead` and previous `behind` entries, nearest first."""
+        paths = []
+        with self.lock:
+            if self.length == 0:
+                return paths
+            for step in range(1, max(ahead, behind) + 1):
+                if step <= ahead:
+                    paths.append(self.filelist[(self.file_index + step) % self.length])
+                if step <= behind:
+                    paths.append(self.filelist[(self.file_index - step) % self.length])
+        return list(dict.fromkeys(paths))
+
+    def entries(self, start, stop) -> list:
+        """Paths of the entries from start up to, not including, stop."""
+        with self.lock:
+            return [self.filelist[i] for i in range(start, min(stop, self.length))]
+
+    def currentType(self) -> FileType:
+        return FileType.getType(self.current().suffix)
+
+
+RATING_OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "!=": operator.ne,
+    "==": operator.eq,
+    "=": operator.eq,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+
+def normalize_keyword(keyword) -> str:
+    return keyword if keyword.startswith("!") else keyword.lower()
+
+
+def parse_filter(expression) -> list:
+    """Parse a --filter expression into (kind, negate, value) terms that are ANDed.
+
+    Terms are separated by spaces: `rating>=8` compares the rating, `#beach`
+    requires a keyword, `-#beach` excludes it and `#beach|#sea` requires any
+    of several keywords.
+    """
+    terms = []
+    for token in expression.split():
+        match = re.fullmatch(r"rating(>=|<=|!=|==|=|>|<)(-?\d+)", token)
+        if match:
+            terms.append(("rating", False, (match.group(1), int(match.group(2)))))
+            continue
+        negate = token.startswith("-")
+        keywords = token[1:] if negate else token
+        alternatives = keywords.split("|")
+        if not all(len(k) > 1 and k[0] in "!@#" for k in alternatives):
+            raise ValueError("bad filter term: " + token)
+        terms.append(
+            ("keywords", negate, [normalize_keyword(k) for k in alternatives])
+        )
+    return terms
+
+
+class KeywordIndex:
+    """Inverted index from keywords and ratings to the filenames that have them."""
+
+    def __init__(self, df):
+        self.filenames = set(df.index)
+        keywords = df["keywords"].str.split().explode().dropna()
+        self.by_keyword = defaultdict(set)
+        for keyword, filenames in keywords.groupby(keywords).groups.items():
+            self.by_keyword[keyword] = set(filenames)
+        self.by_rating = defaultdict(set)
+        for rating, filenames in df.groupby("rating").groups.items():
+            self.by_rating[rating] = set(filenames)
+
+    def set_keywords(self, filename, old, new) -> None:
+        old, new = set(old.split()), set(new.split())
+        for keyword in old - new:
+            self.by_keyword[keyword].discard(filename)
+        for keyword in new - old:
+            self.by_keyword[keyword].add(filename)
+
+    def set_rating(self, filename, old, new) -> None:
+        self.by_rating[old].discard(filename)
+        self.by_rating[new].add(filename)
+
+    def query(self, terms) -> set:
+        result = None
+        excluded = set()
+        for kind, negate, value in terms:
+            if kind == "rating":
+                compare = RATING_OPERATORS[value[0]]
+                matches = set().union(
+                    *(f for r, f in self.by_rating.items() if compare(r, value[1]))
+                )
+            else:
+                matches = set().union(*(self.by_keyword.get(k, ()) for k in value))
+            if negate:
+                excluded |= matches
+            else:
+                result = matches if result is None else result & matches
+        if result is None:
+            result = self.filenames
+        return result - excluded
+
+
+class KeywordDictionary:
+    """Keyword vocabulary for autocompletion.
+
+    Keywords are stored in a trie so a prefix lookup only visits the keywords
+    that match it, and in a usage-count dict that gives O(1) membership and
+    insertion and ranks suggestions by how often each keyword is used.
+    """
+
+    END = ""
+
+    def __init__(self, counts=None):
+        self.trie = {}
+        self.counts = {}
+        for keyword, count in (counts or {}).items():
+            self.add(keyword, count)
+
+    def __contains__(self, keyword) -> bool:
+        return keyword in self.counts
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, keyword, count=1) -> None:
+        if keyword not in self.counts:
+            node = self.trie
+            for c in keyword:
+                node = node.setdefault(c, {})
+            node[self.END] = keyword
+            self.counts[keyword] = 0
+        self.counts[keyword] += count
+
+    def matches(self, prefix, limit=None) -> list:
+        """Keywords starting with prefix, most used first."""
+        node = self.trie
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return []
+        found = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for c, child in node.items():
+                if c == self.END:
+                    found.append(child)
+                else:
+                    stack.append(child)
+        rank = lambda keyword: (-self.counts[keyword], keyword)
+        if limit is None:
+            return sorted(found, key=rank)
+        return heapq.nsmallest(limit, found, key=rank)
+
+
+def column_letter(index) -> str:
+    """Spreadsheet column name for a zero-based column index (0 -> A, 26 -> AA)."""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+class PhotoDB:
+    """Rating/keyword table backed by a CSV file or a Google Sheet.
+
+    Cells changed through set_rating/set_keywords/update_files are tracked so
+    that saving to Google Sheets only sends those cells. `client` replaces the
+    pygsheets client, e.g. with fake_sheets.FakeClient.
+
+    With `journal`, every change to a CSV database is appended to a sidecar
+    `<db>.journal` file as it happens and replayed over the CSV on load;
+    compact() folds the journal back into the CSV.
+
+    A Google Sheet is also kept as a local SQLite snapshot together with the
+    spreadsheet's modification time. When a snapshot exists it is loaded
+    instead of the sheet, and a background thread connects, compares the
+    modification time and only downloads the sheet if it changed since;
+    the changes are then merged under `lock`, keeping the cells edited
+    locally in the meantime.
+    """
+
+    def __init__(self, dbFilename, client=None, journal=False):
+        import pandas as pd
+
+        self.dbFilename=dbFilename
+        self.dirty = set()
+        self.journal = None
+        self.index = None
+        self.lock = threading.RLock()
+        # Set when a fetch changed the table, for the UI to poll and clear.
+        self.changed = threading.Event()
+        refresh = False
+        if Path(dbFilename).suffix.lower()=='.csv':
+            self.googleDB=False
+            self.photo_df=pd.read_csv(dbFilename)
+            self.photo_df["keywords"] = self.photo_df["keywords"].fillna('').astype("str")
+        else:
+            self.googleDB=True
+            self.gc = client
+            self.sheet = None
+            self.worksheet = None
+            self.connect_lock = threading.Lock()
+            self.snapshot_lock = threading.Lock()
+            self.snapshotFilename = (
+                CACHE_DIRECTORY
+                + "/sheets/"
+                + re.sub(r"[^\w.-]", "_", dbFilename)
+                + ".sqlite"
+            )
+            snapshot = self.__read_snapshot()
+            if snapshot is not None:
+                self.photo_df, self.revision, self.sheet_id = snapshot
+                refresh = True
+            else:
+                try:
+                    self.__connect()
+                except Exception as e:
+                    print("Error: sheet non found")
+                    print(e)
+                    sys.exit()
+                self.revision = self.sheet.updated
+                self.sheet_id = self.sheet.id
+                self.photo_df = self.worksheet.get_as_df()
+
+        self.photo_df.set_index("filename", inplace=True)
+        self.photo_df.index.name = "filename"
+        journalFile = Path(dbFilename + ".journal")
+        if journal and not self.googleDB:
+            self.journalFilename = str(journalFile)
+            self.journal_records = self.__replay_journal()
+            self.journal = open(self.journalFilename, "a", encoding="utf-8")
+        elif journalFile.exists() and journalFile.stat().st_size > 0:
+            # compact() leaves an empty journal behind, which holds no edits.
+            print("Warning: ignoring " + dbFilename + ".journal (run with --journal)")
+        self.photo_df["rating"] = (
+            pd.to_numeric(self.photo_df["rating"], errors="coerce")
+            .fillna(0)
+            .astype("int")
+        )
+        self.added = []
+        self.save_lock = threading.Lock()
+        self.__mark_saved()
+        if refresh:
+            threading.Thread(target=self.__refresh, daemon=True).start()
+        elif self.googleDB:
+            threading.Thread(
+                target=self.__write_snapshot,
+                args=(self.photo_df.copy(), self.revision, self.sheet_id),
+                daemon=True,
+            ).start()
+
+    def __connect(self) -> None:
+        """Authorize and open the spreadsheet, unless that has been done already."""
+        with self.connect_lock:
+            if self.worksheet is not None:
+                return
+            if self.gc is None:
+                import pygsheets
+
+                self.gc = pygsheets.authorize(
+                    client_secret=SECRET_FILE, credentials_directory=SECRET_DIRECTORY
+                )
+            sheet = self.gc.open(self.dbFilename)
+            self.worksheet = sheet.sheet1
+            self.sheet = sheet
+
+    def __read_snapshot(self):
+        """(table, modification time, spreadsheet id) of the local snapshot, or None."""
+        if not Path(self.snapshotFilename).exists():
+            return None
+        import pandas as pd
+        # pandas.errors only has it from pandas 1.5 on.
+        from pandas.io.sql import DatabaseError
+
+        try:
+            with closing(sqlite3.connect(self.snapshotFilename)) as conn:
+                meta = dict(conn.execute("SELECT key, value FROM snapshot"))
+                table = pd.read_sql("SELECT * FROM photos ORDER BY rowid", conn)
+        except (sqlite3.Error, DatabaseError) as e:
+            print("Warning: ignoring the snapshot of %s: %s" % (self.dbFilename, e))
+            return None
+        return table, meta.get("revision"), meta.get("id")
+
+    def __write_snapshot(self, table, revision, sheet_id) -> None:
+        tmpfile = self.snapshotFilename + ".tmp"
+        with self.snapshot_lock:
+            # A save or refresh that finished later has a newer snapshot.
+            if revision != self.revision:
+                return
+            try:
+                Path(self.snapshotFilename).parent.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(tmpfile)) as conn:
+                    table.to_sql(
+                        "photos", conn, if_exists="replace", index_label="filename"
+                    )
+                    conn.execute("DROP TABLE IF EXISTS snapshot")
+                    conn.execute(
+                        "CREATE TABLE snapshot (key TEXT PRIMARY KEY, value TEXT)"
+                    )
+                    conn.executemany(
+                        "INSERT INTO snapshot VALUES (?, ?)",
+                        [("revision", revision), ("id", sheet_id)],
+                    )
+                    conn.commit()
+                os.replace(tmpfile, self.snapshotFilename)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                # Only the next start is slower without it.
+                print(
+                    "Warning: cannot write the snapshot of %s: %s"
+                    % (self.dbFilename, e)
+                )
+
+    def __save_snapshot(self, table, current) -> None:
+        """Record the table as just saved, so the next start skips the download.
+
+        If the sheet was edited elsewhere since it was fetched (not current),
+        the old revision is kept so that the next start downloads those edits.
+        """
+        if current:
+            revision, sheet_id = self.sheet.updated, self.sheet.id
+            with self.lock:
+                self.revision, self.sheet_id = revision, sheet_id
+        else:
+            with self.lock:
+                revision, sheet_id = self.revision, self.sheet_id
+        self.__write_snapshot(table, revision, sheet_id)
+
+    def __refresh(self) -> None:
+        """Fetch the sheet if it changed since the snapshot and merge it in."""
+        known = self.revision
+        try:
+            self.__connect()
+            revision = self.sheet.updated
+            if revision == known and self.sheet.id == self.sheet_id:
+                return
+            with PROFILER.span("db_fetch"):
+                remote = self.worksheet.get_as_df()
+        except Exception as e:
+            print("Warning: working from the snapshot of %s: %s" % (self.dbFilename, e))
+            return
+        # Not while a save is writing: its cells are out of dirty, and the
+        # merge would put the sheet's old values back over them.
+        with self.save_lock:
+            if self.revision != known:
+                # A save() got there first and is newer than this download.
+                return
+            self.__take_remote(remote, revision)
+
+    def __take_remote(self, remote, revision) -> None:
+        """Merge the fetched sheet in and make it the snapshot. Needs save_lock."""
+        import pandas as pd
+
+        remote.set_index("filename", inplace=True)
+        remote["rating"] = (
+            pd.to_numeric(remote["rating"], errors="coerce").fillna(0).astype("int")
+        )
+        snapshot = self.__read_snapshot()
+        base = snapshot[0].set_index("filename") if snapshot else remote.iloc[:0]
+        # The merge makes remote the live table; the snapshot gets it as fetched.
+        table = remote.copy()
+        with self.lock:
+            changed = self.__merge(remote, base)
+            self.revision = revision
+            self.sheet_id = self.sheet.id
+        self.__write_snapshot(table, revision, self.sheet_id)
+        print("Fetched %d changed rows of %s" % (changed, self.dbFilename))
+        if changed:
+            self.changed.set()
+
+    def __merge(self, remote, base) -> int:
+        """Replace the table with the sheet's, then redo the local edits and additions.
+
+        Returns the number of rows of the sheet that differ from base.
+        """
+        import pandas as pd
+
+        rows = lambda frame: set(
+            map(tuple, frame.reset_index().astype("str").values.tolist())
+        )
+        if list(remote.columns) == list(base.columns):
+            changed = len(rows(remote) - rows(base))
+        else:
+            changed = len(remote)
+        with self.lock:
+            edits = [
+                (filename, column, self.photo_df.at[filename, column])
+                for filename, column in self.dirty
+            ]
+            added = self.photo_df.loc[self.added]
+            self.photo_df = remote
+            self.dirty = set()
+            self.added = []
+            self.__mark_saved()
+            added = added[~added.index.isin(remote.index)]
+            if len(added):
+                self.__ensure_columns(added.columns)
+                self.photo_df = pd.concat(
+                    [self.photo_df, added.reindex(columns=self.photo_df.columns)]
+                )
+                self.photo_df.index.name = "filename"
+                self.added = list(added.index)
+            for filename, column, value in edits:
+                if filename in self.photo_df.index:
+                    self.__ensure_columns([column])
+                    self.photo_df.at[filename, column] = value
+                    self.dirty.add((filename, column))
+            self.index = None
+        return changed
+
+    def __mark_saved(self, table=None) -> None:
+        """Remember the layout of the saved table so later cells can be addressed."""
+        table = self.photo_df if table is None else table
+        self.saved_columns = [table.index.name] + list(table.columns)
+        self.saved_rows = {filename: row for row, filename in enumerate(table.index, 2)}
+        self.saved_row_count = len(table)
+
+    def __replay_journal(self) -> int:
+        records = []
+        try:
+            with open(self.journalFilename, encoding="utf-8") as fp:
+                for line in fp:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A torn final line from a crash mid-append.
+                        print("Skipping bad journal record: " + line.strip())
+        except FileNotFoundError:
+            return 0
+        if records:
+            latest = {(r["filename"], r["column"]): r["value"] for r in records}
+            import pandas as pd
+
+            self.__apply(pd.Series(latest).unstack())
+            print("Replayed %d journal records" % len(records))
+        return len(records)
+
+    def __journal_write(self, cells) -> None:
+        if self.journal is None:
+            return
+        for filename, column, value in cells:
+            if hasattr(value, "item"):
+                value = value.item()
+            self.journal.write(
+                json.dumps({"filename": filename, "column": column, "value": value})
+                + "\n"
+            )
+            self.journal_records += 1
+        self.journal.flush()
+        os.fdatasync(self.journal.fileno())
+
+    def compact(self) -> None:
+        """Fold the journal into the CSV file and start a new, empty journal."""
+        tmpfile = self.dbFilename + ".tmp"
+        self.photo_df.to_csv(tmpfile)
+        with open(tmpfile, "rb+") as fp:
+            os.fsync(fp.fileno())
+        os.replace(tmpfile, self.dbFilename)
+        self.journal.truncate(0)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_records = 0
+        self.dirty.clear()
+        self.added = []
+        print("Compacted journal into " + self.dbFilename)
+
+    def __contains__(self, filename) -> bool:
+        return filename in self.photo_df.index
+
+    def row(self, filename):
+        """(rating, keywords) of filename from a single index lookup, or None."""
+        try:
+            loc = self.photo_df.index.get_loc(filename)
+        except KeyError:
+            return None
+        # Duplicate filenames give a slice or boolean mask; use the first row.
+        if isinstance(loc, slice):
+            loc = loc.start
+        elif not isinstance(loc, int):
+            loc = int(loc.argmax())
+        return (
+            self.photo_df.iat[loc, self.photo_df.columns.get_loc("rating")],
+            self.photo_df.iat[loc, self.photo_df.columns.get_loc("keywords")],
+        )
+
+    def rating(self, filename) -> int:
+        return self.photo_df.at[filename, "rating"]
 
-    def __is_relevant_event(self, event):
-        return event.widget == self.root
+    def keywords(self, filename) -> str:
+        return self.photo_df.at[filename, "keywords"]
 
-    def __restartCB(self, event=None) -> None:
-        if (
-            self.__is_relevant_event(event)
-            and self.filelist.currentType() == FileType.VIDEO
-        ):
-            self.video_player.set_state(Gst.State.NULL)
-            self.video_player.set_state(Gst.State.PLAYING)
+    def missing_files(self, filenames) -> list:
+        import pandas as pd
 
-    def __nextCB(self, event=None) -> None:
-        if self.__is_relevant_event(event):
-            self.filelist.next_file()
-            self.__updateDisplay()
+        return list(pd.Index(filenames).difference(self.photo_df.index))
 
-    def __prevCB(self, event=None) -> None:
-        if self.__is_relevant_event(event):
-            self.filelist.prev_file()
-            self.__updateDisplay()
+    @property
+    def keyword_index(self) -> KeywordIndex:
+        if self.index is None:
+            self.index = KeywordIndex(self.photo_df)
+        return self.index
 
-    def __exitCB(self, event=None) -> None:
-        if self.__is_relevant_event(event):
-            event.widget.withdraw()
-            event.widget.quit()
+    def query(self, terms) -> set:
+        return self.keyword_index.query(terms)
 
-    def __showKeywordEntryCB(self, event=None) -> None:
-        if self.__is_relevant_event(event):
-            self.keywordText.set(event.char)
-            self.keywordEntry.place(
-                relx=0.5, rely=0.5, anchor=tkinter.CENTER, relwidth=0.5
-            )
-            self.keywordEntry.icursor("end")
-            self.keywordEntry.focus_set()
+    def keyword_counts(self) -> dict:
+        return self.photo_df["keywords"].str.split().explode().dropna().value_counts().to_dict()
 
-    def __hideKeywordEntry(self) -> None:
-        self.keywordEntry.place_forget()
-        self.root.focus_set()
+    def __set(self, filename, column, value) -> None:
+        with self.lock:
+            if self.index is not None and column == "keywords":
+                self.index.set_keywords(
+                    filename, self.photo_df.at[filename, column], value
+                )
+            elif self.index is not None and column == "rating":
+                self.index.set_rating(filename, self.photo_df.at[filename, column], value)
+            self.photo_df.at[filename, column] = value
+            self.dirty.add((filename, column))
+            self.__journal_write([(filename, column, value)])
 
-    def __setKeywordOutput(self, val) -> None:
-        for t in self.keywordOutput:
-            t.destroy()
-        for t in val.split():
-            tempLabel = tkinter.Label(
-                self.metadataFrame,
-                font=("Arial", self.w // 80),
-                bg="black",
-                fg="white",
-                anchor=tkinter.E,
-            )
-            tempLabel["text"] = t
-            tempLabel.pack(fill="x")
-            self.keywordOutput.append(tempLabel)
+    def set_rating(self, filename, value) -> None:
+        self.__set(filename, "rating", value)
 
-    def __saveDBCB(self, event=None) -> None:
-        if self.__is_relevant_event(event):
-            self.db.save()
+    def set_keywords(self, filename, keywords) -> None:
+        self.__set(filename, "keywords", keywords)
 
-    def __setRatingCB(self, event=None) -> None:
-        if self.__is_relevant_event(event):
-            value = ratingvalue[event.char]
-            filename = str(self.filelist.current().name)
-            if filename in self.db.photo_df.index:
-                self.db.photo_df.at[filename, "rating"] = value
+    def __ensure_columns(self, columns) -> None:
+        missing = [c for c in columns if c not in self.photo_df.columns]
+        if not missing:
+            return
+        for column in missing:
+            self.photo_df[column] = ""
+        known = [c for c in DB_COLUMNS if c in self.photo_df.columns]
+        extra = [c for c in self.photo_df.columns if c not in known]
+        self.photo_df = self.photo_df[known + extra]
 
-            self.__updateDisplay()
+    def __apply(self, frame):
+        frame = frame[~frame.index.duplicated(keep="last")]
+        frame = frame[frame.index.isin(self.photo_df.index)]
+        self.__ensure_columns(frame.columns)
+        for column in frame.columns:
+            values = frame[column].dropna()
+            if self.photo_df[column].dtype != values.dtype:
+                self.photo_df[column] = self.photo_df[column].astype("object")
+            self.photo_df.loc[values.index, column] = values
+        return frame
 
-    def __matchString(self):
-        got = self.keywordText.get()
-        return [item for item in self.keywordDictionary if item.startswith(got)]
+    def update_files(self, frame) -> None:
+        """Overwrite the columns of `frame` for the filenames already in the DB."""
+        with self.lock:
+            frame = self.__apply(frame)
+            columns = list(frame.columns)
+            if "keywords" in columns or "rating" in columns:
+                self.index = None
+            self.dirty.update(
+                (filename, column) for filename in frame.index for column in columns
+            )
+            self.__journal_write(
+                (filename, column, frame.at[filename, column])
+                for filename in frame.index
+                for column in columns
+            )
 
-    def __showHit(self, lst) -> None:
-        if len(lst) == 1:
-            self.keywordText.set(lst[0])
-            self.detect_pressed_filled = True
+    def add_files(self, frame) -> int:
+        """Add rows for the filenames in `frame` that are not in the DB yet.
 
-    def __keywordEntryKeyreleaseCB(self, event) -> None:
-        if len(event.keysym) == 1:
-            hits = self.__matchString()
-            self.__showHit(hits)
+        Columns missing from `frame` get the defaults, rating 0 and no
+        keywords. The new rows are written by the next save(): appended to the
+        sheet in one request, or with the whole file for CSV databases.
+        Returns the number of rows added.
+        """
+        import pandas as pd
 
-    def __keywordEntryKeypressCB(self, event) -> None:
-        key = event.char
-        if len(key) == 1 and self.detect_pressed_filled is True:
-            pos = self.keywordEntry.index(tkinter.INSERT)
-            self.keywordEntry.delete(pos, tkinter.END)
+        with self.lock:
+            frame = frame[~frame.index.duplicated(keep="first")]
+            frame = frame[~frame.index.isin(self.photo_df.index)]
+            if len(frame) == 0:
+                return 0
+            self.__ensure_columns(frame.columns)
+            new = frame.reindex(columns=self.photo_df.columns)
+            new["rating"] = new["rating"].fillna(0).astype("int")
+            new["keywords"] = new["keywords"].fillna("").astype("str")
+            self.photo_df = pd.concat([self.photo_df, new])
+            self.photo_df.index.name = "filename"
+            self.index = None
+            self.added.extend(new.index)
+            return len(new)
 
-    def __keywordEntryAcceptCB(self, _event) -> None:
-        df = self.db.photo_df
-        filename = str(self.filelist.current().name)
-        keywords = re.findall(
-            r"[!#@].+?(?=[!#@]|$)", "".join(self.keywordText.get().split())
+    def __layout_changed(self) -> bool:
+        columns = [self.photo_df.index.name] + list(self.photo_df.columns)
+        added = set(self.added)
+        return columns != self.saved_columns or any(
+            filename not in self.saved_rows and filename not in added
+            for filename, _column in self.dirty
         )
 
-        for keyword in keywords:
-            if keyword[0] != "!":
-                keyword = keyword.lower()
-            if len(df.at[filename, "keywords"].strip()) > 0:
-                curKeywords = df.at[filename, "keywords"].strip().split()
-                if keyword in curKeywords:
-                    curKeywords.remove(keyword)
+    @property
+    def unsaved(self) -> bool:
+        """Whether save() has anything to write."""
+        with self.lock:
+            if self.journal is not None:
+                return (
+                    bool(self.added) or self.journal_records >= JOURNAL_COMPACT_RECORDS
+                )
+            return bool(self.dirty or self.added)
+
+    def __row_values(self, table, filenames) -> list:
+        rows = table.loc[filenames, self.saved_columns[1:]].reset_index()
+        return rows.astype("object").where(rows.notna(), "").values.tolist()
+
+    def __cell_values(self, table, cells):
+        ranges = []
+        values = []
+        for filename, column in sorted(cells):
+            value = table.at[filename, column]
+            ranges.append(
+                "%s%d"
+                % (
+                    column_letter(self.saved_columns.index(column)),
+                    self.saved_rows[filename],
+                )
+            )
+            values.append([[value.item() if hasattr(value, "item") else value]])
+        return ranges, values
+
+    def save(self) -> None:
+        """Write the pending changes.
+
+        The lock is only held while the changes are copied, so edits can go on
+        while the copy is written. If writing fails the changes are pending
+        again and the exception is raised. Journal compaction is the
+        exception: it runs under the lock, since it truncates the journal.
+        A sheet edited elsewhere is fetched and merged first, since its rows
+        may have moved.
+        """
+        with self.save_lock:
+            if self.googleDB:
+                self.__connect()
+                revision = self.sheet.updated
+                if revision != self.revision:
+                    # Edited elsewhere, maybe sorted or with rows inserted:
+                    # cells can only be addressed after reading the rows again.
+                    with PROFILER.span("db_fetch"):
+                        remote = self.worksheet.get_as_df()
+                    self.__take_remote(remote, revision)
+                # Whether the sheet is still as last fetched, so that its
+                # revision after this save covers nothing but this table.
+                current = self.sheet.updated == self.revision
+            with self.lock:
+                if self.journal is not None:
+                    # Replaying the journal only updates rows that are in the
+                    # CSV, so added rows go into the CSV right away.
+                    if self.journal_records >= JOURNAL_COMPACT_RECORDS or self.added:
+                        self.compact()
+                    else:
+                        print(
+                            "%d edits already saved in %s"
+                            % (self.journal_records, self.journalFilename)
+                        )
+                    self.dirty.clear()
+                    return
+                layout_changed = self.googleDB and self.__layout_changed()
+                table = self.photo_df.copy()
+                if self.googleDB and not layout_changed:
+                    # Cells of added rows go out with the appended rows.
+                    new = set(self.added)
+                    rows = self.__row_values(table, self.added) if new else []
+                    ranges, values = self.__cell_values(
+                        table, [cell for cell in self.dirty if cell[0] not in new]
+                    )
+                dirty, added = self.dirty, self.added
+                self.dirty, self.added = set(), []
+            try:
+                if not self.googleDB:
+                    self.__save_csv(table)
+                    dirty, added = set(), []
+                elif layout_changed:
+                    self.__save_worksheet(table)
+                    dirty, added = set(), []
                 else:
-                    curKeywords.append(keyword)
-                df.at[filename, "keywords"] = " ".join(curKeywords)
-            else:
-                df.at[filename, "keywords"] = keyword
+                    if rows:
+                        self.worksheet.append_table(
+                            rows, start="A1", dimension="ROWS", overwrite=False
+                        )
+                        with self.lock:
+                            first = self.saved_row_count + 2
+                            for row, filename in enumerate(added, first):
+                                self.saved_rows.setdefault(filename, row)
+                            self.saved_row_count += len(added)
+                        print("finished appending %d rows" % len(rows))
+                        added = []
+                    if ranges:
+                        self.worksheet.update_values_batch(ranges, values)
+                        print("finished saving %d cells" % len(ranges))
+                    dirty = set()
+            except Exception:
+                with self.lock:
+                    self.dirty |= dirty
+                    self.added = added + [f for f in self.added if f not in added]
+                raise
+        if self.googleDB:
+            # A full rewrite replaced whatever was edited elsewhere.
+            self.__save_snapshot(table, current or layout_changed)
 
-            if keyword not in self.keywordDictionary:
-                self.keywordDictionary.append(keyword)
+    def __save_worksheet(self, table) -> None:
+        title = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
+        worksheet = self.sheet.add_worksheet(title, rows=10, cols=10, index=0)
+        worksheet.clear()
+        out_tbl = table.reset_index()
+        worksheet.set_dataframe(out_tbl, "A1", copy_index=False, extend=True)
+        print("finished saving")
+        oldsheet = self.sheet.worksheet("index", 3)  # What is this?
+        self.sheet.del_worksheet(oldsheet)
+        with self.lock:
+            self.worksheet = worksheet
+            self.__mark_saved(table)
 
-        #    print(df.at[f.current(),'keywords'])
-        self.__setKeywordOutput(df.at[filename, "keywords"])
-        self.__hideKeywordEntry()
+    def __save_csv(self, table) -> None:
+        extension = datetime.now().strftime("_%m%d%Y%H%M%S.csv")
+        if re.match(r'.*_\d{14}\.csv',self.dbFilename.lower()):
+            newcsvfile=re.sub(r'_\d{14}\.csv',extension,self.dbFilename.lower())
+        else:
+            newcsvfile=re.sub(r'\.csv',extension,self.dbFilename.lower())
+        print('Saving: '+newcsvfile)
+        table.to_csv(newcsvfile)
 
-    def __keywordEntryCancelCB(self, _event) -> None:
-        self.__hideKeywordEntry()
 
+class SQLitePhotoDB:
+    """PhotoDB backend that keeps the table in SQLite instead of in memory.
 
-class FileList:
-    def __init__(self, recursive=False, first=None, input_filelist=None):
-        if not input_filelist:
-            input_pathlist = (
-                Path.cwd().rglob("*.*") if recursive else Path.cwd().glob("*.*")
+    Per-file lookups and edits are indexed point queries, each edit is its own
+    transaction, and keywords are also stored one per row in photo_keywords
+    so they can be queried without scanning the keyword strings.
+    """
+
+    def __init__(self, dbFilename):
+        self.dbFilename = dbFilename
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(dbFilename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        with self.conn:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS photos (
+                    filename TEXT PRIMARY KEY,
+                    hash TEXT,
+                    size INTEGER,
+                    directory TEXT,
+                    rating INTEGER NOT NULL DEFAULT 0,
+                    keywords TEXT NOT NULL DEFAULT ''
+                );
+                CREATE INDEX IF NOT EXISTS photos_hash ON photos (hash);
+                CREATE INDEX IF NOT EXISTS photos_rating ON photos (rating);
+                CREATE TABLE IF NOT EXISTS photo_keywords (
+                    keyword TEXT NOT NULL,
+                    filename TEXT NOT NULL
+                        REFERENCES photos (filename) ON DELETE CASCADE,
+                    PRIMARY KEY (keyword, filename)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS photo_keywords_filename
+                    ON photo_keywords (filename);
+                """
             )
-        else:
-            input_pathlist=(
-                Path(file).absolute()
-                for file in input_filelist
+
+    def __value(self, filename, column):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT %s FROM photos WHERE filename=?" % column, (filename,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(filename)
+        return row[0]
+
+    def __contains__(self, filename) -> bool:
+        with self.lock:
+            return (
+                self.conn.execute(
+                    "SELECT 1 FROM photos WHERE filename=?", (filename,)
+                ).fetchone()
+                is not None
             )
 
-        self.filelist = [
-            file
-            for file in sorted(input_pathlist)
-            if FileType.getType(file.suffix) != FileType.UNKNOWN
-        ]
-        self.length = len(self.filelist)
-        self.file_index = 0
+    def row(self, filename):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT rating, keywords FROM photos WHERE filename=?", (filename,)
+            ).fetchone()
 
-        if first is not None:
-            while Path(first).absolute() > self.current() and self.file_index<self.length-1:
-                self.file_index += 1
+    def rating(self, filename) -> int:
+        return self.__value(filename, "rating")
 
-    def next_file(self) -> Path:
-        self.file_index = (self.file_index + 1) % self.length
-        return self.current()
+    def keywords(self, filename) -> str:
+        return self.__value(filename, "keywords")
 
-    def prev_file(self) -> Path:
-        self.file_index = (self.file_index - 1) % self.length
-        return self.current()
+    def missing_files(self, filenames) -> list:
+        filenames = sorted(set(filenames))
+        known = set()
+        with self.lock:
+            for start in range(0, len(filenames), 500):
+                chunk = filenames[start : start + 500]
+                known.update(
+                    name
+                    for (name,) in self.conn.execute(
+                        "SELECT filename FROM photos WHERE filename IN (%s)"
+                        % ",".join("?" * len(chunk)),
+                        chunk,
+                    )
+                )
+        return [name for name in filenames if name not in known]
 
-    def current(self) -> Path:
-        return self.filelist[self.file_index]
+    def __set_keywords(self, filename, keywords) -> None:
+        self.conn.execute(
+            "UPDATE photos SET keywords=? WHERE filename=?", (keywords, filename)
+        )
+        self.conn.execute("DELETE FROM photo_keywords WHERE filename=?", (filename,))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO photo_keywords VALUES (?, ?)",
+            [(keyword, filename) for keyword in keywords.split()],
+        )
 
-    def currentType(self) -> FileType:
-        return FileType.getType(self.current().suffix)
+    def set_rating(self, filename, value) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE photos SET rating=? WHERE filename=?", (int(value), filename)
+            )
 
+    def set_keywords(self, filename, keywords) -> None:
+        with self.lock, self.conn:
+            self.__set_keywords(filename, keywords)
 
-class PhotoDB:
-    def __init__(self, dbFilename):
-        self.dbFilename=dbFilename
-        if Path(dbFilename).suffix.lower()=='.csv':
-            self.googleDB=False
-            self.photo_df=pd.read_csv(dbFilename)
-            self.photo_df["keywords"] = self.photo_df["keywords"].fillna('').astype("str")
-        else:
-            self.googleDB=True
-            self.gc = pygsheets.authorize(
-                client_secret=SECRET_FILE, credentials_directory=SECRET_DIRECTORY
+    def update_files(self, frame) -> None:
+        """Overwrite the columns of `frame` for the filenames already in the DB."""
+        columns = [c for c in frame.columns if c in DB_COLUMNS and c != "keywords"]
+        frame = frame[~frame.index.duplicated(keep="last")]
+        rows = frame[columns].astype("object").where(frame[columns].notna(), None)
+        with self.lock, self.conn:
+            if columns:
+                self.conn.executemany(
+                    "UPDATE photos SET %s WHERE filename=?"
+                    % ", ".join("%s=?" % c for c in columns),
+                    [(*values, filename) for filename, *values in rows.itertuples()],
+                )
+            if "keywords" in frame.columns:
+                for filename, keywords in frame["keywords"].items():
+                    self.__set_keywords(filename, keywords)
+
+    def add_files(self, frame) -> int:
+        """Insert rows for the filenames in `frame` that are not in the DB yet."""
+        columns = [c for c in ("hash", "size", "directory", "rating") if c in frame.columns]
+        frame = frame[~frame.index.duplicated(keep="first")]
+        rows = frame[columns].astype("object").where(frame[columns].notna(), None)
+        with self.lock, self.conn:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO photos (filename%s) VALUES (?%s)"
+                % ("".join(", " + c for c in columns), ", ?" * len(columns)),
+                rows.itertuples(),
             )
-            self.sheet = self.gc.open(dbFilename)
+        return cursor.rowcount
 
-            try:
-                worksheet1 = self.sheet.sheet1
-            except Exception as e:
-                print("Error: sheet non found")
-                print(e)
-                sys.exit()
+    def query(self, terms) -> set:
+        clauses = []
+        params = []
+        for kind, negate, value in terms:
+            if kind == "rating":
+                op = "=" if value[0] == "==" else value[0]
+                clauses.append("rating %s ?" % op)
+                params.append(value[1])
+            else:
+                clauses.append(
+                    "filename %sIN (SELECT filename FROM photo_keywords WHERE keyword IN (%s))"
+                    % ("NOT " if negate else "", ",".join("?" * len(value)))
+                )
+                params.extend(value)
+        with self.lock:
+            return {
+                filename
+                for (filename,) in self.conn.execute(
+                    "SELECT filename FROM photos WHERE %s"
+                    % (" AND ".join(clauses) or "1"),
+                    params,
+                )
+            }
 
-            self.photo_df = worksheet1.get_as_df()
+    def keyword_counts(self) -> dict:
+        with self.lock:
+            return dict(
+                self.conn.execute(
+                    "SELECT keyword, COUNT(*) FROM photo_keywords GROUP BY keyword"
+                )
+            )
 
-        self.photo_df.set_index("filename", inplace=True)
-        self.photo_df.index.name = "filename"
-        self.photo_df["rating"] = (
-            pd.to_numeric(self.photo_df["rating"], errors="coerce")
-            .fillna(0)
-            .astype("int")
-        )
-        self.initialKeywords = set()
-        self.photo_df["keywords"].str.split().apply(self.initialKeywords.update)
+    def import_frame(self, frame) -> None:
+        """Insert or replace rows from a DataFrame laid out like the CSV/Sheets table."""
+        import pandas as pd
+
+        frame = frame.reset_index() if frame.index.name == "filename" else frame
+        frame = frame.drop_duplicates("filename", keep="last")
+        for column in DB_COLUMNS:
+            if column not in frame.columns:
+                frame[column] = None
+        frame["rating"] = pd.to_numeric(frame["rating"], errors="coerce").fillna(0).astype("int")
+        frame["keywords"] = frame["keywords"].fillna("").astype("str")
+        rows = frame[["filename"] + DB_COLUMNS].astype("object")
+        rows = rows.where(rows.notna(), None)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO photos (filename, %s) VALUES (?, ?, ?, ?, ?, ?)"
+                % ", ".join(DB_COLUMNS),
+                rows.itertuples(index=False, name=None),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO photo_keywords VALUES (?, ?)",
+                [
+                    (keyword, filename)
+                    for filename, keywords in zip(frame["filename"], frame["keywords"])
+                    for keyword in keywords.split()
+                ],
+            )
+        print("Imported %d rows into %s" % (len(frame), self.dbFilename))
+
+    @property
+    def unsaved(self) -> bool:
+        # Every edit is committed as it happens.
+        return False
 
     def save(self) -> None:
-        if self.googleDB==True:
-            title = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
-            worksheet = self.sheet.add_worksheet(title, rows=10, cols=10, index=0)
-            worksheet.clear()
-            out_tbl = self.photo_df.reset_index()
-            worksheet.set_dataframe(out_tbl, "A1", copy_index=False, extend=True)
-            print("finished saving")
-            oldsheet = self.sheet.worksheet("index", 3)  # What is this?
-            self.sheet.del_worksheet(oldsheet)
-        else:
-            extension = datetime.now().strftime("_%m%d%Y%H%M%S.csv")
-            if re.match(r'.*_\d{14}\.csv',self.dbFilename.lower()):
-                newcsvfile=re.sub(r'_\d{14}\.csv',extension,self.dbFilename.lower())
-            else:
-                newcsvfile=re.sub(r'\.csv',extension,self.dbFilename.lower())
-            print('Saving: '+newcsvfile)
-            self.photo_df.to_csv(newcsvfile)
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        print("finished saving")
+
+
+def open_photo_db(dbFilename, journal=False):
+    """PhotoDB for a CSV file or Google Sheet, SQLitePhotoDB for .sqlite/.db files."""
+    if Path(dbFilename).suffix.lower() in (".sqlite", ".db"):
+        return SQLitePhotoDB(dbFilename)
+    return PhotoDB(dbFilename, journal=journal)
+
+
 '''
 class MockDB:
     def __init__(self, FileList):
@@ -562,14 +4371,183 @@ def parse_arguments():
         dest="first",
         default=None,
     )
+    parser.add_argument(
+        "--sort",
+        help="order of the files: by name (default), capture date or rating (best first)",
+        action="store",
+        dest="sort",
+        choices=["name", "date", "rating"],
+        default="name",
+    )
     parser.add_argument(
         "-d",
         "--db",
-        help="Enable GoogleSheets Database",
+        help="Enable GoogleSheets Database (or .csv, .sqlite/.db file)",
         action="store",
         dest="DB",
         default=None,
     )
+    parser.add_argument(
+        "--prefetch",
+        help="number of upcoming images to decode ahead of time",
+        action="store",
+        dest="prefetch",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--prefetch-behind",
+        help="number of previous images to keep decoded",
+        action="store",
+        dest="prefetch_behind",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--cache-mb",
+        help="memory budget in MB for decoded images",
+        action="store",
+        dest="cache_mb",
+        type=int,
+        default=512,
+    )
+    parser.add_argument(
+        "--render-cache",
+        help="file used to persist screen-sized renders between sessions",
+        action="store",
+        dest="render_cache",
+        default=CACHE_DIRECTORY + "/renders.sqlite",
+    )
+    parser.add_argument(
+        "--render-cache-mb",
+        help="disk budget in MB for persisted renders (0 disables)",
+        action="store",
+        dest="render_cache_mb",
+        type=int,
+        default=2048,
+    )
+    parser.add_argument(
+        "--rebuild-cache",
+        help="render all images to the render cache using all cores, then exit",
+        action="store_true",
+        dest="rebuild_cache",
+    )
+    parser.add_argument(
+        "--hash",
+        help="hash every file, fill the hash/size/directory columns and report duplicates, then exit",
+        action="store_true",
+        dest="hash",
+    )
+    parser.add_argument(
+        "--ingest",
+        help="add the files that are not in the database yet, with rating 0 and no keywords, then exit",
+        action="store_true",
+        dest="ingest",
+    )
+    parser.add_argument(
+        "--journal",
+        help="append edits to a CSV database's .journal file instead of writing copies",
+        action="store_true",
+        dest="journal",
+    )
+    parser.add_argument(
+        "--compact",
+        help="fold the journal of a CSV database back into the CSV, then exit",
+        action="store_true",
+        dest="compact",
+    )
+    parser.add_argument(
+        "--import-csv",
+        help="copy the rows of a CSV database into a .sqlite/.db --db, then exit",
+        action="store",
+        dest="import_csv",
+        default=None,
+    )
+    parser.add_argument(
+        "--filter",
+        help="only show files matching e.g. 'rating>=8 #beach -#sunset' (needs --db)",
+        action="store",
+        dest="filter",
+        default=None,
+    )
+    parser.add_argument(
+        "--video-pipelines",
+        help="video pipelines kept open, including the prerolled next video (1 disables preroll)",
+        action="store",
+        dest="video_pipelines",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--watch",
+        help="follow files being added, changed and removed while the slideshow runs",
+        action="store_true",
+        dest="watch",
+    )
+    parser.add_argument(
+        "--watch-add",
+        help="with --watch, add new files to the database",
+        action="store_true",
+        dest="watch_add",
+    )
+    parser.add_argument(
+        "--follow",
+        help="with --watch, jump to each newly arrived file",
+        action="store_true",
+        dest="follow",
+    )
+    parser.add_argument(
+        "--thumbnail-size",
+        help="edge in pixels of the thumbnails in the grid view (g)",
+        action="store",
+        dest="thumbnail_size",
+        type=int,
+        default=192,
+    )
+    parser.add_argument(
+        "--thumbnail-cache-mb",
+        help="memory for decoded grid thumbnails in MiB",
+        action="store",
+        dest="thumbnail_cache_mb",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--autosave",
+        help="save changes to the --db every SECONDS, in the background",
+        action="store",
+        dest="autosave",
+        type=int,
+        default=0,
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--tile-cache-mb",
+        help="memory for decoded tiles in the zoom view (z) in MiB",
+        action="store",
+        dest="tile_cache_mb",
+        type=int,
+        default=128,
+    )
+    parser.add_argument(
+        "--profile",
+        help="print per-stage latency percentiles on exit",
+        action="store_true",
+        dest="profile",
+    )
+    parser.add_argument(
+        "--trace",
+        help="with --profile, write one JSON line per navigation event to this file",
+        action="store",
+        dest="trace",
+        default=None,
+    )
+    parser.add_argument(
+        "--startup-time",
+        help="print the time from launch to the first painted frame, then exit",
+        action="store_true",
+        dest="startup_time",
+    )
     parser.add_argument(
         "files",
         help="(optional) list of files to display",
@@ -579,11 +4557,159 @@ def parse_arguments():
     return parser.parse_args()
 
 
+class HashCache:
+    """Content hashes of files keyed by (device, inode, size, mtime) in SQLite."""
+
+    def __init__(self, filename):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS hashes (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (device, inode, size, mtime)
+            )"""
+        )
+
+    @staticmethod
+    def key(st) -> tuple:
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, key):
+        row = self.conn.execute(
+            "SELECT hash FROM hashes WHERE device=? AND inode=? AND size=? AND mtime=?",
+            key,
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, items) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+            [(*key, digest) for key, digest in items],
+        )
+        self.conn.commit()
+
+
+def hash_file(filename) -> str:
+    digest = hashlib.sha256()
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(filename, "rb", buffering=0) as fp:
+        while True:
+            n = fp.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def hash_files(paths, hash_cache):
+    """Return a DataFrame of hash, size and directory per path, indexed by filename.
+
+    Files whose (device, inode, size, mtime) is already in the cache are not
+    read again; the rest are hashed in parallel by a process pool.
+    """
+    import pandas as pd
+
+    rows = []
+    todo = []
+    for path in paths:
+        try:
+            st = path.stat()
+        except OSError as e:
+            print(e)
+            continue
+        key = HashCache.key(st)
+        rows.append([path, key, hash_cache.get(key)])
+        if rows[-1][2] is None:
+            todo.append(len(rows) - 1)
+
+    print("Hashing %d of %d files" % (len(todo), len(rows)))
+    with ProcessPoolExecutor() as pool:
+        digests = pool.map(hash_file, [rows[i][0] for i in todo])
+        for done, (i, digest) in enumerate(zip(todo, digests), 1):
+            rows[i][2] = digest
+            if done % 1000 == 0:
+                print("%d/%d" % (done, len(todo)))
+    hash_cache.put_many((rows[i][1], rows[i][2]) for i in todo)
+
+    out = pd.DataFrame(
+        {
+            "path": [str(path) for path, _key, _digest in rows],
+            "hash": [digest for _path, _key, digest in rows],
+            "size": [key[2] for _path, key, _digest in rows],
+            "directory": [str(path.parent) for path, _key, _digest in rows],
+        },
+        index=pd.Index([path.name for path, _key, _digest in rows], name="filename"),
+    )
+    return out
+
+
+def _stat_sizes(paths) -> list:
+    sizes = []
+    for path in paths:
+        try:
+            sizes.append(path.stat().st_size)
+        except OSError as e:
+            print(e)
+            sizes.append(None)
+    return sizes
+
+
+def stat_files(paths):
+    """Return a DataFrame of size and directory per path, indexed by filename.
+
+    The stats run in chunks on a thread pool, since they mostly wait on the
+    file system; paths that cannot be stat'ed are left out.
+    """
+    import pandas as pd
+
+    paths = list(paths)
+    chunks = [paths[i : i + STAT_CHUNK_SIZE] for i in range(0, len(paths), STAT_CHUNK_SIZE)]
+    with ThreadPoolExecutor(max_workers=32, thread_name_prefix="stat") as pool:
+        sizes = [size for chunk in pool.map(_stat_sizes, chunks) for size in chunk]
+    out = pd.DataFrame(
+        {"size": sizes, "directory": [str(path.parent) for path in paths]},
+        index=pd.Index([path.name for path in paths], name="filename"),
+    )
+    out = out[out["size"].notna()]
+    out["size"] = out["size"].astype("int64")
+    return out
+
+
+def ingest_files(f: FileList, photoDB) -> None:
+    """Add every file of the FileList that is not in the DB yet, then save."""
+    f.wait()
+    missing = set(photoDB.missing_files([path.name for path in f.filelist]))
+    paths = [path for path in f.filelist if path.name in missing]
+    print("Adding %d of %d files" % (len(missing), f.length))
+    if not paths:
+        return
+    added = photoDB.add_files(stat_files(paths))
+    with PROFILER.span("db_save"):
+        photoDB.save()
+    print("Added %d files" % added)
+
+
+def print_duplicates(hashes) -> None:
+    duplicated = hashes[hashes["hash"].duplicated(keep=False)]
+    if len(duplicated) > 0:
+        groups = duplicated.groupby("hash")["path"]
+        print("# duplicate groups: " + str(groups.ngroups))
+        for digest, group in groups:
+            print(digest)
+            for path in group:
+                print("    " + path)
+
+
 def print_new_files(f: FileList, photoDB) -> None:
     if photoDB is not None:
+        f.wait()
         filelist = [p.name for p in f.filelist]
-        infile_table = pd.Index(filelist)
-        diff = infile_table.difference(photoDB.photo_df.index)
+        diff = photoDB.missing_files(filelist)
         if len(diff) > 0:
             print("# files not in DB: " + str(len(diff)))
             for d in diff:
@@ -591,12 +4717,113 @@ def print_new_files(f: FileList, photoDB) -> None:
 
 
 def main():
-    Gst.init(None)
-
     args = parse_arguments()
+    startup = StartupTimer() if args.startup_time else None
+    if args.profile:
+        PROFILER.enable(args.trace)
+
+    if args.compact:
+        if not args.DB or Path(args.DB).suffix.lower() != ".csv":
+            print("Error: --compact needs a CSV --db")
+            sys.exit(1)
+        PhotoDB(args.DB, journal=True).compact()
+        return
+
+    photoDB = open_photo_db(args.DB, journal=args.journal) if args.DB else None
+    if startup:
+        startup.mark("database")
+    if args.import_csv:
+        if not isinstance(photoDB, SQLitePhotoDB):
+            print("Error: --import-csv needs a .sqlite/.db --db")
+            sys.exit(1)
+        import pandas as pd
+
+        photoDB.import_frame(pd.read_csv(args.import_csv))
+        return
+
+    accept = None
+    if args.filter:
+        if photoDB is None:
+            print("Error: --filter needs --db")
+            sys.exit(1)
+        try:
+            matches = photoDB.query(parse_filter(args.filter))
+        except ValueError as e:
+            print("Error: " + str(e))
+            sys.exit(1)
+        accept = lambda path: path.name in matches
+
+    order = None
+    if args.sort == "date":
+        # Only sorting by date reads every header up front; the other orders
+        # leave the orientation to the decoder's own EXIF parse.
+        METADATA.open(CACHE_DIRECTORY + "/metadata.sqlite")
+        order = SortOrder("date", metadata=METADATA)
+    elif args.sort == "rating":
+        if photoDB is None:
+            print("Error: --sort rating needs --db")
+            sys.exit(1)
+        order = SortOrder("rating", photoDB=photoDB)
 
-    f = FileList(recursive=args.recursive, first=args.first, input_filelist=args.files)
-    photoDB = PhotoDB(args.DB) if args.DB else None
+    f = FileList(
+        recursive=args.recursive,
+        first=args.first,
+        input_filelist=args.files,
+        accept=accept,
+        order=order,
+    )
+    if f.length == 0:
+        print("No media files found")
+        return
+    if startup:
+        startup.mark("filelist")
+    if args.watch and args.files:
+        print("Error: --watch follows a scanned directory, not a list of files")
+        sys.exit(1)
+    if (args.watch_add or args.follow) and not args.watch:
+        print("Error: --watch-add and --follow need --watch")
+        sys.exit(1)
+    if args.autosave and photoDB is None:
+        print("Error: --autosave needs --db")
+        sys.exit(1)
+    render_cache = (
+        RenderCache(args.render_cache, args.render_cache_mb * 1024 * 1024)
+        if args.render_cache_mb > 0
+        else None
+    )
+    if args.rebuild_cache:
+        if render_cache is None:
+            print("Error: render cache is disabled")
+            sys.exit(1)
+        if args.size:
+            w, h = (int(v) for v in args.size.split("x"))
+        else:
+            screen = tkinter.Tk()
+            w, h = screen.winfo_screenwidth(), screen.winfo_screenheight()
+            screen.destroy()
+        f.wait()
+        rebuild_render_cache(f, render_cache, w, h)
+        return
+
+    if args.ingest:
+        if photoDB is None:
+            print("Error: --ingest needs --db")
+            sys.exit(1)
+        ingest_files(f, photoDB)
+        return
+
+    if args.hash:
+        f.wait()
+        hashes = hash_files(list(f.filelist), HashCache(CACHE_DIRECTORY + "/hashes.sqlite"))
+        print_duplicates(hashes)
+        if photoDB is not None:
+            photoDB.update_files(hashes[["hash", "size", "directory"]])
+            with PROFILER.span("db_save"):
+                photoDB.save()
+        return
+
+    if args.watch:
+        f.watch()
     root = tkinter.Tk()
     if args.size:
         root.geometry("%s+0+0" % args.size)
@@ -607,10 +4834,38 @@ def main():
     root.configure(background="black")
     root.update_idletasks()
     root.focus_set()
+    if startup:
+        startup.mark("window")
 
-    print_new_files(f, photoDB)
+    threading.Thread(target=print_new_files, args=(f, photoDB), daemon=True).start()
 
-    App(root, f, photoDB)
+    prefetcher = Prefetcher(
+        ImageCache(args.cache_mb * 1024 * 1024),
+        ahead=args.prefetch,
+        behind=args.prefetch_behind,
+        render_cache=render_cache,
+    )
+    app = App(
+        root,
+        f,
+        photoDB,
+        prefetcher,
+        args.video_pipelines,
+        thumbnail_size=args.thumbnail_size,
+        thumbnail_cache_bytes=args.thumbnail_cache_mb * 1024 * 1024,
+        auto_add=args.watch_add,
+        follow=args.follow,
+        tile_cache_bytes=args.tile_cache_mb * 1024 * 1024,
+        autosave=args.autosave,
+    )
+    if startup:
+        root.update()
+        startup.mark("first frame")
+        startup.report()
+        prefetcher.shutdown()
+        app.videos.release()
+        root.destroy()
+        return
     root.mainloop()
 
 
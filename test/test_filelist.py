@@ -0,0 +1,61 @@
+"""FileList scanning against the order of the original sorted(glob) list.
+
+Run from the repository root with `python -m pytest test/`.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import show_media  # noqa: E402
+
+TEST_DIRECTORY = Path(__file__).resolve().parent
+
+
+def baseline(recursive):
+    """The list as FileList built it before the scan moved to a background thread."""
+    paths = Path.cwd().rglob("*.*") if recursive else Path.cwd().glob("*.*")
+    return [
+        path
+        for path in sorted(paths)
+        if show_media.FileType.getType(path.suffix) != show_media.FileType.UNKNOWN
+    ]
+
+
+def scanned(recursive):
+    filelist = show_media.FileList(recursive=recursive)
+    first = filelist.current()
+    filelist.wait()
+    return first, filelist.file_index, filelist.entries(0, filelist.length)
+
+
+def test_starts_on_first_file(monkeypatch):
+    monkeypatch.chdir(TEST_DIRECTORY)
+    expected = baseline(False)
+    first, index, entries = scanned(False)
+    assert first == expected[0]
+    assert index == 0
+    assert entries == expected
+
+
+def test_recursive_order(tmp_path, monkeypatch):
+    for name in ["b.jpg", "a/x.jpg", "a/y/z.png", "c.png", "d/e.mov", "d.jpg"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+    monkeypatch.chdir(tmp_path)
+    expected = baseline(True)
+    first, index, entries = scanned(True)
+    assert first == tmp_path / "a/x.jpg"
+    assert index == 0
+    assert entries == expected
+
+
+def test_recursive_skips_directory_symlinks(tmp_path, monkeypatch):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a/x.jpg").touch()
+    (tmp_path / "b.jpg").touch()
+    (tmp_path / "a/up").symlink_to("..")
+    (tmp_path / "loop").symlink_to(".")
+    monkeypatch.chdir(tmp_path)
+    _first, _index, entries = scanned(True)
+    assert entries == [tmp_path / "a/x.jpg", tmp_path / "b.jpg"]
@@ -0,0 +1,139 @@
+"""PhotoDB against the Google Sheets backend, through fake_sheets.FakeClient.
+
+Run from the repository root with `python -m pytest test/`.
+"""
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fake_sheets  # noqa: E402
+import show_media  # noqa: E402
+
+PHOTOS = Path(__file__).resolve().parent / "photos.csv"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(show_media, "CACHE_DIRECTORY", str(tmp_path))
+    return fake_sheets.FakeClient({"photodb": pd.read_csv(PHOTOS)})
+
+
+def sheet_rows(client):
+    values = client.open("photodb").sheet1.values
+    return {row[0]: row for row in values[1:]}
+
+
+def calls(client, name):
+    return [c for c in client.open("photodb").sheet1.calls if c[0] == name]
+
+
+def test_add_edit_save(client):
+    db = show_media.PhotoDB("photodb", client=client)
+    db.set_rating("02_venus.jpg", 3)
+    db.add_files(pd.DataFrame({"rating": [0]}, index=pd.Index(["new.jpg"], name="filename")))
+    # An edit to a row that is not in the sheet yet goes out with the append.
+    db.set_rating("new.jpg", 4)
+    db.set_keywords("new.jpg", "#new")
+    db.save()
+
+    rows = sheet_rows(client)
+    assert rows["new.jpg"][:3] == ["new.jpg", 4, "#new"]
+    assert rows["02_venus.jpg"][1] == 3
+    assert len(calls(client, "append_table")) == 1
+    assert calls(client, "update_values_batch") == [("update_values_batch", ["B3"])]
+    assert not db.unsaved
+
+    # Once appended, the new row is saved cell by cell like the others.
+    db.set_rating("new.jpg", 5)
+    db.save()
+    assert sheet_rows(client)["new.jpg"][1] == 5
+    assert len(calls(client, "append_table")) == 1
+    assert not db.unsaved
+
+
+def test_failed_save_keeps_changes(client):
+    db = show_media.PhotoDB("photodb", client=client)
+    worksheet = client.open("photodb").sheet1
+    update = worksheet.update_values_batch
+
+    def fail(*args, **kwargs):
+        raise OSError("quota exceeded")
+
+    worksheet.update_values_batch = fail
+    db.set_rating("03_earth.jpg", 1)
+    with pytest.raises(OSError):
+        db.save()
+    assert db.unsaved
+
+    worksheet.update_values_batch = update
+    db.save()
+    assert sheet_rows(client)["03_earth.jpg"][1] == 1
+    assert not db.unsaved
+
+
+def wait_for_refresh(db, client):
+    # The refresh runs on its own thread; it is done when the revision moved.
+    deadline = time.monotonic() + 5
+    while db.revision != client.open("photodb").updated:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_refresh_merges_remote_edits(client):
+    db = show_media.PhotoDB("photodb", client=client)
+    db.set_rating("01_mercury.jpg", 1)
+    db.save()  # writes the snapshot the next start loads from
+
+    # Edited in the browser while the program was not running.
+    client.open("photodb").sheet1.update_value("C3", "#planet #venus #edited")
+
+    db = show_media.PhotoDB("photodb", client=client)
+    db.set_rating("04_mars.jpg", 2)
+    wait_for_refresh(db, client)
+
+    assert db.keywords("02_venus.jpg") == "#planet #venus #edited"
+    # For the UI to redraw; it polls the flag from the Tk thread.
+    assert db.changed.wait(5)
+    assert db.rating("01_mercury.jpg") == 1
+    # The local edit survives the merge and is still pending.
+    assert db.rating("04_mars.jpg") == 2
+    assert db.unsaved
+    db.save()
+    assert sheet_rows(client)["04_mars.jpg"][1] == 2
+
+
+def test_save_keeps_remote_edits_for_next_start(client):
+    db = show_media.PhotoDB("photodb", client=client)
+    # Edited in the browser during the session, then saved here.
+    client.open("photodb").sheet1.update_value("C3", "#remote-edit")
+    db.set_rating("01_mercury.jpg", 1)
+    db.save()
+
+    db = show_media.PhotoDB("photodb", client=client)
+    wait_for_refresh(db, client)
+    assert db.keywords("02_venus.jpg") == "#remote-edit"
+    assert db.rating("01_mercury.jpg") == 1
+
+
+def test_save_after_sheet_was_sorted(client):
+    db = show_media.PhotoDB("photodb", client=client)
+    # Sorted in the browser during the session: every row moved.
+    worksheet = client.open("photodb").sheet1
+    values = worksheet.values
+    worksheet.set_dataframe(
+        pd.DataFrame(values[:0:-1], columns=values[0]), "A1", copy_index=False
+    )
+    db.set_rating("01_mercury.jpg", 1)
+    db.set_keywords("09_pluto.jpg", "#dwarf")
+    db.save()
+
+    rows = sheet_rows(client)
+    assert rows["01_mercury.jpg"][1] == 1
+    assert rows["09_pluto.jpg"][2] == "#dwarf"
+    assert rows["02_venus.jpg"][1:3] == [9, "#planet #venus"]
+    assert calls(client, "set_dataframe") == [("set_dataframe", len(values) - 1)]